@@ -5,8 +5,14 @@ import socket
 #HA_NOARCHBIN = "/usr/share/crmsh/hb_report"
 
 ###############constants##########
+ARGOPTS_LONG = ["timeout=", "low-impact", "bwlimit=", "budget=", "estimate", "max-size=",
+                "since-report=", "merge", "daemon", "recorder-size=", "relays=", "profile"]
 ARGOPTS_VALUE = "f:t:l:u:X:p:L:e:E:n:MSDZVsvhdQ"
 B_CONF = None
+BUDGET = 0
+BWLIMIT = 0
+BT_TIMEOUT = 60
+CACHE_DIR = "/var/cache/hb_report"
 CIB_DIR = None
 COMPRESS = 1
 COMPRESS_PROG = ""
@@ -15,11 +21,18 @@ CORES_DIRS = None
 CONF = None
 CRM_DAEMON_DIR = None
 CTS = ""
+DAEMON = 0
+DEADLINE = 0
+DELTA_BASE = None
 DEST = ""
 DESTDIR = ""
+# above this many bytes, files are compared by diff(1) instead of difflib
+DIFF_MAX_SIZE = 8*1024*1024
 DO_SANITIZE = 0
+ESTIMATE = 0
 EXTRA_LOGS = "/var/log/messages /var/log/pacemaker.log"
 FORCE_REMOVE_DEST = ""
+FORKS_AVOIDED = 0
 FROM_TIME = ""
 GET_STAMP_FUNC = None
 HA_DEBUGFILE = None
@@ -30,23 +43,47 @@ HA_LOGLEVEL = "info"
 HA_BIN = None
 HA_VARLIB = None
 LOCAL_SUDO = ""
+# about how much smaller a rotated and compressed log is than its text
+LOG_COMPRESS_RATIO = 10
+LOG_MMAP = 1
+LOW_IMPACT = 0
+LOW_IMPACT_WORKERS = 1
+MAX_JOBS = 32
+MAX_SIZE = 0
+MERGE = None
 LOG_PATTERNS="CRIT: ERROR:"
 NO_DESCRIPTION = 1
 NO_SSH = ""
+NODE_TIMEOUT = 0
 NODES = ""
 OCF_DIR = None
 PACKAGES = None
+PARALLEL_SCAN_SIZE = 64*1024*1024
 PCMK_LIB = None
 PCMK_LOG = "/var/log/pacemaker.log"
 PE_STATE_DIR = None
+PROBE_TIMEOUT = 30
+PROFILE = 0
 PTEST = "crm_simulate"
+RECORDER_INTERVAL = 10
+RELAY_NODES = ""
+RELAYS = 0
+RECORDER_SEGMENT = 16*1024*1024
+RECORDER_SIZE = 256*1024*1024
+RECORDER_SNAPSHOTS = 20
 SANITIZE = "passw.*"
+SCAN_CHUNK_SIZE = 8*1024*1024
+SCAN_WORKERS = 0
+SINCE = ""
 SKIP_LVL = 0
+SKIPPED_STEPS = []
 SLAVE = 0
 SLAVEPIDS = None
+SPAWNED = 0
 SSH_OPTS = "-o StrictHostKeyChecking=no -o EscapeChar=none -o ConnectTimeout=15"
 SSH_PASSWORD_NODES = ""
 SSH_USER = ""
+START_TIME = 0
 SUDO = ""
 THIS_IS_NODE = 0
 TMP = None
@@ -112,6 +149,43 @@ Component: [choose one] CRM LRM CCM RA fencing openais comm GUI tools other
 Detailed description:         
 
 """
+# Value of the optional collectors for the --budget planner
+# (higher is more important), and their cost in seconds until
+# there are timings of previous runs
+COLLECTOR_VALUES = {
+    "check_perms": 3,
+    "corosync_blackbox": 4,
+    "crm_config": 4,
+    "dlm_dump": 1,
+    "get_backtraces": 6,
+    "get_configurations": 5,
+    "get_pe_inputs": 8,
+    "get_ratraces": 4,
+    "pe_to_dot": 1,
+    "sanitize": 2,
+    "sys_info": 6,
+    "sys_stats": 5,
+    "time_status": 3,
+    "touch_dc": 2,
+    "verify_packages": 2,
+}
+COLLECTOR_COSTS = {
+    "check_perms": 0.1,
+    "corosync_blackbox": 2,
+    "crm_config": 3,
+    "dlm_dump": 0.1,
+    "get_backtraces": 5,
+    "get_configurations": 0.5,
+    "get_pe_inputs": 2,
+    "get_ratraces": 1,
+    "pe_to_dot": 10,
+    "sanitize": 5,
+    "sys_info": 5,
+    "sys_stats": 3,
+    "time_status": 1,
+    "touch_dc": 1,
+    "verify_packages": 30,
+}
 ###############some long end######################
 
 ###############goods##################
@@ -127,13 +201,23 @@ CRM_MON_F = "crm_mon.txt"
 CRM_VERIFY_F = "crm_verify.txt"
 DESCRIPTION_F = "description.txt"
 DLM_DUMP_F = "dlm_dump.txt"
+ESTIMATE_F = "estimate.txt"
 HALOG_F = "ha-log.txt"
 HB_UUID_F = "hb_uuid.txt"
 HOSTCACHE = "hostcache"
+IMPACT_F = "impact.txt"
+INCOMPLETE_F = "incomplete.txt"
+JOURNAL_CURSOR_F = "journal.cursor"
 JOURNAL_F = "journal.log"
+MANIFEST_F = "manifest.txt"
 MEMBERSHIP_F = "members.txt"
 PERMISSIONS_F = "permissions.txt"
+PLAN_F = "plan.txt"
+PROFILE_F = "profile.%s.pstats"
+SPANS_F = "spans.txt"
 SYSINFO_F = "sysinfo.txt"
 SYSSTATS_F = "sysstats.txt"
 TIME_F = "time.txt"
+TIMINGS_F = "timings.json"
+TRIMMED_F = "trimmed.txt"
 ###############goods end##############
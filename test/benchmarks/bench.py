@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# See COPYING for license information.
+"""
+Time the log scanning hot paths and the start of a slave of hb_report
+on a synthetic corpus.
+
+Every benchmark runs in a process of its own, a few times over. One
+line of JSON per benchmark is printed: the fastest and the median
+time, the throughput in MB/s of the median and the peak RSS. With -b
+the results are compared to a baseline saved with -o before, and the
+exit code is 1 if a benchmark got slower or bigger by more than the
+threshold.
+
+usage: bench.py [-c dir] [-s MB] [-f fmt] [-n N] [-b file] [-t pct] [-o file] [name ...]
+        -c: corpus directory, made if needed and kept (dflt: a temporary one)
+        -s: MB of the live log of the corpus (dflt: 64)
+        -f: format of the log: syslog, rfc5424 or legacy (dflt: syslog)
+        -n: runs of each benchmark (dflt: 5)
+        -b: baseline to compare to
+        -t: percent slower than the baseline which is a regression (dflt: 10)
+        -o: save the results as a baseline
+        name: benchmarks to run (dflt: all)
+"""
+import getopt
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, REPO)
+import constants
+import utillib
+
+DAY = 24 * 3600
+
+def logs(ctx):
+    """
+    the rotation chain of the corpus, oldest first
+    """
+    return utillib.arch_logs(ctx["log"], ctx["from_time"], ctx["to_time"])[::-1]
+
+def bench_arch_logs(ctx):
+    nbytes = sum(os.path.getsize(f) for f in logs(ctx))
+    return nbytes, lambda: utillib.arch_logs(ctx["log"], ctx["from_time"], ctx["to_time"])
+
+def bench_dump_logset(ctx):
+    outf = os.path.join(ctx["tmpdir"], "dump")
+    def run():
+        utillib.dump_logset(ctx["log"], ctx["from_time"], ctx["to_time"], outf)
+    run()
+    return os.path.getsize(outf), run
+
+def bench_events(ctx):
+    destdir = os.path.join(ctx["tmpdir"], "events")
+    os.mkdir(destdir)
+    os.symlink(ctx["log"], os.path.join(destdir, constants.HALOG_F))
+    constants.NODES = "node1"
+    return os.path.getsize(ctx["log"]), lambda: utillib.events(destdir)
+
+def bench_find_files(ctx):
+    pe_dir = os.path.join(ctx["corpus"], "pengine")
+    from_time = ctx["end"] - DAY / 2
+    files = utillib.find_files(pe_dir, from_time, ctx["end"])
+    nbytes = sum(os.path.getsize(f) for f in files)
+    return nbytes, lambda: utillib.find_files(pe_dir, from_time, ctx["end"])
+
+def bench_findln_by_time(ctx):
+    return os.path.getsize(ctx["log"]), \
+        lambda: utillib.findln_by_time(ctx["log"], ctx["end"] - DAY / 2)
+
+def bench_findpos_by_time(ctx):
+    def run():
+        view = utillib.log_view(ctx["log"])
+        utillib.findpos_by_time(view, ctx["end"] - DAY / 2)
+    return os.path.getsize(ctx["log"]), run
+
+def bench_grep(ctx):
+    return os.path.getsize(ctx["log"]), \
+        lambda: utillib.grep("ERROR|crit:", infile=ctx["log"])
+
+def bench_sanitize_one(ctx):
+    in_file = os.path.join(ctx["tmpdir"], "sanitize")
+    def run():
+        # the copy is part of the time, but it's the same in every run
+        shutil.copyfile(ctx["log"], in_file)
+        utillib.sanitize_one(in_file)
+    return os.path.getsize(ctx["log"]), run
+
+def bench_import(ctx):
+    """
+    a fresh interpreter importing utillib, as every slave does
+    """
+    cmd = [sys.executable, "-c", "import utillib"]
+    return 0, lambda: subprocess.check_call(cmd, cwd=REPO)
+
+def bench_slave_startup(ctx):
+    """
+    import and the environment setup of a slave; needs crmsh and
+    the cluster packages
+    """
+    cmd = [sys.executable, "-c", "import utillib; utillib.check_env(); utillib.compatibility_pcmk()"]
+    return 0, lambda: subprocess.check_call(cmd, cwd=REPO)
+
+def bench_sub_string(ctx):
+    with open(ctx["log"]) as f:
+        data = f.read(16*1024*1024)
+    return len(data), lambda: utillib.sub_string(data)
+
+BENCHMARKS = dict((name[len("bench_"):], func) for name, func in globals().items()
+                  if name.startswith("bench_"))
+
+def measure(name, ctx, runs):
+    """
+    run benchmark name in this process; return its results
+    """
+    nbytes, run = BENCHMARKS[name](ctx)
+    times = []
+    for _ in range(runs):
+        t = time.time()
+        run()
+        times.append(time.time() - t)
+    times.sort()
+    median = times[len(times) / 2]
+    return {"name": name,
+            "runs": runs,
+            "bytes": nbytes,
+            "min_seconds": round(times[0], 4),
+            "median_seconds": round(median, 4),
+            "mb_per_second": round(nbytes / 1024.0 / 1024 / median, 1) if nbytes and median else None,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def fork_measure(name, ctx, runs):
+    """
+    measure name in a child, so that its peak RSS is its own
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        tmpdir = tempfile.mkdtemp(prefix="hb_report_bench.")
+        ctx["tmpdir"] = tmpdir
+        constants.TMPFLIST = os.path.join(tmpdir, "tmpflist")
+        try:
+            res = measure(name, ctx, runs)
+        except Exception as err:
+            res = {"name": name, "error": str(err)}
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        os.write(wfd, json.dumps(res, sort_keys=True))
+        os._exit(0)
+    os.close(wfd)
+    data = ""
+    while True:
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            break
+        data += chunk
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    if not data:
+        return {"name": name, "error": "benchmark died"}
+    return json.loads(data)
+
+def regressions(results, baseline, threshold):
+    """
+    messages about the results worse than baseline by more than
+    threshold percent
+    """
+    res = []
+    base = dict((r["name"], r) for r in baseline)
+    limit = 1 + threshold / 100.0
+    for r in results:
+        b = base.get(r["name"])
+        if not b or "error" in b:
+            continue
+        if "error" in r:
+            res.append("%s: %s" % (r["name"], r["error"]))
+            continue
+        for key in ("median_seconds", "peak_rss_kb"):
+            if b[key] and r[key] > b[key] * limit:
+                res.append("%s: %s %s, was %s (+%d%%)" % \
+                           (r["name"], key, r[key], b[key], (r[key] / float(b[key]) - 1) * 100))
+    return res
+
+def main(argv):
+    try:
+        opt, names = getopt.getopt(argv[1:], "c:s:f:n:b:t:o:h")
+    except getopt.GetoptError:
+        print(__doc__)
+        return 1
+    corpus_dir = None
+    size = 64
+    fmt = "syslog"
+    runs = 5
+    baseline_f = None
+    threshold = 10
+    out_f = None
+    for args, option in opt:
+        if args == "-c":
+            corpus_dir = option
+        if args == "-s":
+            size = int(option)
+        if args == "-f":
+            fmt = option
+        if args == "-n":
+            runs = int(option)
+        if args == "-b":
+            baseline_f = option
+        if args == "-t":
+            threshold = float(option)
+        if args == "-o":
+            out_f = option
+        if args == "-h":
+            print(__doc__)
+            return 0
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        print("unknown benchmark(s): %s; try: %s" % (' '.join(unknown), ' '.join(sorted(BENCHMARKS))))
+        return 1
+    keep = corpus_dir is not None
+    if not keep:
+        corpus_dir = tempfile.mkdtemp(prefix="hb_report_corpus.")
+    end = corpus.make_corpus(corpus_dir, size=size*1024*1024, fmt=fmt)
+    ctx = {"corpus": corpus_dir,
+           "log": os.path.join(corpus_dir, "messages"),
+           "end": end,
+           # the end of the rotated log before the live one and the live one
+           "from_time": end - DAY - DAY / 2,
+           "to_time": end - DAY / 2}
+    results = []
+    for name in names or sorted(BENCHMARKS):
+        res = fork_measure(name, ctx, runs)
+        print(json.dumps(res, sort_keys=True))
+        sys.stdout.flush()
+        results.append(res)
+    if not keep:
+        shutil.rmtree(corpus_dir)
+    if out_f:
+        with open(out_f, 'w') as f:
+            json.dump({"size_mb": size, "format": fmt, "results": results}, f,
+                      indent=2, sort_keys=True)
+    if baseline_f:
+        with open(baseline_f) as f:
+            baseline = json.load(f)
+        if baseline.get("size_mb") != size or baseline.get("format") != fmt:
+            print("baseline is of a %sMB %s corpus; the times won't compare" % \
+                  (baseline.get("size_mb"), baseline.get("format")))
+        worse = regressions(results, baseline["results"], threshold)
+        for msg in worse:
+            print("REGRESSION %s" % msg)
+        if worse:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# See COPYING for license information.
+"""
+Generate a synthetic corpus of pacemaker logs and PE inputs for the
+benchmarks.
+
+The logs are written line by line, so gigabyte sizes are fine. Each
+log is a rotation chain: the live file and older files compressed with
+gzip, bzip2 and xz (if installed). A share of the lines is malformed
+or has no time stamp.
+
+usage: corpus.py [-s MB] [-f syslog|rfc5424|legacy] [-r N] [-p N] [-b ratio] dir
+        -s: MB of the live log (dflt: 64); each rotated one is a quarter
+        -f: format of the log (dflt: syslog)
+        -r: rotated logs (dflt: 3)
+        -p: PE inputs (dflt: 2000)
+        -b: share of bad lines (dflt: 0.001)
+"""
+import bz2
+import getopt
+import gzip
+import os
+import random
+import subprocess
+import sys
+import time
+
+DAEMONS = ["pacemaker-controld", "pacemaker-schedulerd", "pacemaker-execd",
+           "pacemaker-fenced", "pacemaker-based", "corosync"]
+
+MESSAGES = ["notice: State transition S_IDLE -> S_POLICY_ENGINE",
+            "notice: Calculated transition %d, saving inputs in /var/lib/pacemaker/pengine/pe-input-%d.bz2",
+            "info: executing - rsc:dummy%d action:monitor call_id:%d",
+            "notice: Result of monitor operation for dummy%d on node1: ok | call=%d",
+            "info: Forwarding cib_modify operation for section status to all (origin=local/crmd/%d) %d",
+            "warning: Processing failed start of dummy%d on node2: not running | rc=%d",
+            "ERROR: Resource dummy%d failed to start, rc=%d",
+            "crit: Fencing operation %d of node%d failed",
+            "info: <nvpair id=\"db-password-%d\" name=\"passwd\" value=\"secret%d\"/>"]
+
+# how often each of MESSAGES occurs
+WEIGHTS = [30, 10, 30, 20, 8, 1, 0.5, 0.1, 0.4]
+
+def stamp(fmt, ts):
+    t = time.localtime(ts)
+    if fmt == "rfc5424":
+        return time.strftime("%Y-%m-%dT%H:%M:%S", t) + ".%06d+00:00" % (ts % 1 * 1000000)
+    if fmt == "legacy":
+        return time.strftime("%Y/%m/%d_%H:%M:%S", t)
+    return time.strftime("%b %d %H:%M:%S", t)
+
+def log_lines(fmt, size, start, end, bad=0.001, seed=0):
+    """
+    yield about size bytes of log lines in fmt spread over [start, end)
+    """
+    rnd = random.Random(seed)
+    total = sum(WEIGHTS)
+    # the average line is about 110 bytes
+    nlines = max(1, size / 110)
+    step = (end - start) / float(nlines)
+    for i in range(nlines):
+        ts = start + i * step
+        r = rnd.random()
+        if r < bad / 2:
+            yield "%s\n" % ("x" * rnd.randint(1, 200))
+            continue
+        if r < bad:
+            yield "   continued: %s\n" % MESSAGES[0]
+            continue
+        pick = rnd.random() * total
+        for msg, w in zip(MESSAGES, WEIGHTS):
+            pick -= w
+            if pick <= 0:
+                break
+        msg = msg % (rnd.randint(1, 5000), rnd.randint(1, 5000)) if '%' in msg else msg
+        daemon = "%s[%d]" % (rnd.choice(DAEMONS), rnd.randint(1000, 9999))
+        if fmt == "legacy":
+            yield "%s: %s %s\n" % (daemon, stamp(fmt, ts), msg)
+        else:
+            yield "%s node1 %s: %s\n" % (stamp(fmt, ts), daemon, msg)
+
+def write_log(path, lines, compress=None):
+    if compress == "gz":
+        f = gzip.open(path, 'wb')
+    elif compress == "bz2":
+        f = bz2.BZ2File(path, 'wb')
+    else:
+        f = open(path, 'w')
+    buf = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= 10000:
+            f.write(''.join(buf))
+            buf = []
+    f.write(''.join(buf))
+    f.close()
+    if compress == "xz":
+        subprocess.check_call(["xz", "-T0", "-1", path])
+
+def make_logs(out_dir, name, fmt, size, rotated, bad, end):
+    """
+    write the rotation chain of name, newest first: name (size bytes)
+    and name-1.gz, name-2.bz2, name-3.xz, ... (size/4 bytes each),
+    each covering a day; return the paths, oldest first
+    """
+    compressions = ["gz", "bz2", "xz"]
+    if subprocess.call("which xz >/dev/null 2>&1", shell=True) != 0:
+        compressions.remove("xz")
+    paths = []
+    day = 24 * 3600
+    for i in range(rotated, 0, -1):
+        comp = compressions[(i - 1) % len(compressions)]
+        path = os.path.join(out_dir, "%s-%d" % (name, i))
+        start = end - (i + 1) * day
+        write_log(path if comp == "xz" else "%s.%s" % (path, comp),
+                  log_lines(fmt, size / 4, start, start + day, bad, seed=i), comp)
+        path = "%s.%s" % (path, comp)
+        os.utime(path, (start + day, start + day))
+        paths.append(path)
+    path = os.path.join(out_dir, name)
+    write_log(path, log_lines(fmt, size, end - day, end, bad))
+    paths.append(path)
+    return paths
+
+def make_pe_inputs(pe_dir, count, start, end):
+    """
+    count bzip2ed PE inputs with mtimes spread over [start, end)
+    """
+    if not os.path.isdir(pe_dir):
+        os.makedirs(pe_dir)
+    cib = '<cib epoch="%d"><configuration><resources>%s</resources></configuration></cib>'
+    prims = ''.join('<primitive id="dummy%d" class="ocf" provider="pacemaker" type="Dummy"/>' % i
+                    for i in range(50))
+    for i in range(count):
+        path = os.path.join(pe_dir, "pe-input-%d.bz2" % i)
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(cib % (i, prims)))
+        t = start + (end - start) * i / float(count)
+        os.utime(path, (t, t))
+
+def make_corpus(out_dir, size=64*1024*1024, fmt="syslog", rotated=3, pe_inputs=2000, bad=0.001):
+    """
+    the corpus in out_dir, made if it isn't there already with the
+    same parameters; return the time its logs end at
+    """
+    params = "%d %s %d %d %s" % (size, fmt, rotated, pe_inputs, bad)
+    stamp_f = os.path.join(out_dir, "corpus.params")
+    if os.path.isfile(stamp_f):
+        saved, end = open(stamp_f).read().rsplit(' ', 1)
+        if saved == params:
+            return float(end)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # a whole number of seconds, for the formats without fractions
+    end = int(time.time())
+    make_logs(out_dir, "messages", fmt, size, rotated, bad, end)
+    make_pe_inputs(os.path.join(out_dir, "pengine"), pe_inputs, end - 24 * 3600, end)
+    with open(stamp_f, 'w') as f:
+        f.write("%s %d" % (params, end))
+    return end
+
+def main(argv):
+    try:
+        opt, arg = getopt.getopt(argv[1:], "s:f:r:p:b:h")
+    except getopt.GetoptError:
+        print(__doc__)
+        return 1
+    kw = {}
+    for args, option in opt:
+        if args == "-s":
+            kw["size"] = int(option) * 1024 * 1024
+        if args == "-f":
+            kw["fmt"] = option
+        if args == "-r":
+            kw["rotated"] = int(option)
+        if args == "-p":
+            kw["pe_inputs"] = int(option)
+        if args == "-b":
+            kw["bad"] = float(option)
+        if args == "-h":
+            print(__doc__)
+            return 0
+    if len(arg) != 1:
+        print(__doc__)
+        return 1
+    make_corpus(arg[0], **kw)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# See COPYING for license information.
+"""
+Fake a cluster on this machine and time hb_report on it.
+
+Every node gets a directory under the simulation root with its logs,
+pengine inputs, CIB and crm_mon output. A stand-in for ssh runs the
+slave as the node it was asked for, and stub crm_mon, cibadmin,
+crm_node and crm answer from the node's directory. For each cluster
+size one line of JSON is printed: wall clock time, bytes the slaves
+sent, the size of the report and the peak RSS of the processes.
+
+The machine needs crmsh and the cluster packages (crm_simulate, the
+hacluster user, ...) installed, but no cluster running.
+
+usage: simcluster.py [-n 2,4,8] [-s MB] [-p N] [-k] [-- hb_report options]
+        -n: cluster sizes to run (dflt: 2,4,8)
+        -s: MB of logs per node (dflt: 4)
+        -p: pengine inputs per node (dflt: 50)
+        -k: keep the simulation root and the reports
+"""
+import bz2
+import getopt
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+SSH = r'''#!%(python)s
+# ssh stand-in: run the command as the node named on the command line
+import os, subprocess, sys
+args = sys.argv[1:]
+while args and args[0].startswith('-'):
+    args = args[2:] if args[0] in ("-o", "-l", "-p", "-i", "-F") else args[1:]
+node = args[0].split('@')[-1]
+cmd = ' '.join(args[1:])
+if cmd.startswith("sudo -u root "):
+    cmd = cmd[len("sudo -u root "):]
+if not os.path.isdir(os.path.join(os.environ["HB_SIM_ROOT"], node)):
+    sys.stderr.write("ssh: Could not resolve hostname %%s\n" %% node)
+    sys.exit(255)
+os.environ["HB_SIM_NODE"] = node
+proc = subprocess.Popen(cmd.replace("%%NODE%%", node), shell=True, stdout=subprocess.PIPE)
+nbytes = 0
+while True:
+    data = proc.stdout.read(65536)
+    if not data:
+        break
+    nbytes += len(data)
+    sys.stdout.write(data)
+with open(os.path.join(os.environ["HB_SIM_ROOT"], "bytes"), 'a') as f:
+    f.write("%%s %%d\n" %% (node, nbytes))
+sys.exit(proc.wait())
+'''
+
+HB_REPORT = r'''#!%(python)s
+# hb_report as the node the ssh stand-in runs it for
+import os, socket, sys
+import crmsh.config
+root = os.environ["HB_SIM_ROOT"]
+crmsh.config.path.ocf_root = os.path.join(root, "ocf")
+crmsh.config.path.crm_daemon_dir = os.path.join(root, "bin")
+node = os.environ.get("HB_SIM_NODE")
+if node:
+    socket.gethostname = lambda: node
+crmsh.config.path.pe_state_dir = os.path.join(root, node or "master", "pengine")
+crmsh.config.path.crm_config = os.path.join(root, node or "master", "cib")
+sys.path.insert(0, "%(repo)s")
+import constants, utillib
+compatibility_pcmk = utillib.compatibility_pcmk
+def sim_compatibility_pcmk():
+    compatibility_pcmk()
+    constants.CONF = os.path.join(root, node or "master", "corosync.conf")
+utillib.compatibility_pcmk = sim_compatibility_pcmk
+sys.argv[0] = os.path.join("%(repo)s", "hb_report")
+execfile(sys.argv[0])
+'''
+
+STUB = r'''#!/bin/sh
+# %(name)s stand-in: answer from the node's directory
+dir="$HB_SIM_ROOT/$HB_SIM_NODE"
+case "%(name)s $*" in
+crm_mon*) cat "$dir/crm_mon.txt" ;;
+cibadmin*) cat "$dir/cib/cib.xml" ;;
+"crm_node -p"*) echo $HB_SIM_NODES ;;
+"crm node server"*) for n in $HB_SIM_NODES; do echo $n; done ;;
+"crm configure show"*) cat "$dir/cib/cib.xml" ;;
+"crm --version"*) echo "crm 3.0.0" ;;
+*) exit 0 ;;
+esac
+'''
+
+COROSYNC_CONF = """totem {
+    version: 2
+    cluster_name: sim
+}
+logging {
+    to_logfile: yes
+    logfile: %s
+    to_syslog: yes
+    debug: off
+    timestamp: on
+}
+"""
+
+MESSAGES = ["pacemaker-controld[%d]: notice: State transition S_IDLE -> S_POLICY_ENGINE",
+            "pacemaker-schedulerd[%d]: notice: Calculated transition 12, saving inputs",
+            "pacemaker-execd[%d]: info: executing - rsc:dummy action:monitor call_id:4",
+            "corosync[%d]: [TOTEM ] A processor joined or left the membership",
+            "pacemaker-controld[%d]: ERROR: Resource dummy failed to start"]
+
+def write_log(path, node, size, start, end, rfc5424=False):
+    """
+    size bytes of log lines of node spread evenly over [start, end)
+    """
+    lines = []
+    nbytes = 0
+    while nbytes < size:
+        msg = random.choice(MESSAGES[:-1] if random.random() > 0.01 else MESSAGES) % \
+              random.randint(1000, 9999)
+        lines.append(msg)
+        nbytes += len(msg) + 40
+    step = (end - start) / float(len(lines))
+    with open(path, 'w') as f:
+        for i, msg in enumerate(lines):
+            t = time.localtime(start + i * step)
+            if rfc5424:
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", t)
+            else:
+                stamp = time.strftime("%b %d %H:%M:%S", t)
+            f.write("%s %s %s\n" % (stamp, node, msg))
+
+def make_node(root, node, nodes, log_mb, pe_inputs, start, end):
+    node_dir = os.path.join(root, node)
+    for d in ("var/log", "pengine", "cib"):
+        os.makedirs(os.path.join(node_dir, d))
+    write_log(os.path.join(node_dir, "var/log/messages"), node, log_mb * 1024 * 1024 / 2, start, end)
+    write_log(os.path.join(node_dir, "var/log/pacemaker.log"), node, log_mb * 1024 * 1024 / 2,
+              start, end, rfc5424=True)
+    cib = '<cib epoch="12" num_updates="3" admin_epoch="0">\n  <configuration>\n    <nodes>\n'
+    cib += ''.join('      <node id="%d" uname="%s"/>\n' % (i + 1, n) for i, n in enumerate(nodes))
+    cib += '    </nodes>\n  </configuration>\n</cib>\n'
+    with open(os.path.join(node_dir, "cib", "cib.xml"), 'w') as f:
+        f.write(cib)
+    with open(os.path.join(node_dir, "corosync.conf"), 'w') as f:
+        f.write(COROSYNC_CONF % os.path.join(node_dir, "var/log/pacemaker.log"))
+    with open(os.path.join(node_dir, "crm_mon.txt"), 'w') as f:
+        f.write("Online: [ %s ]\n" % ' '.join(nodes))
+    for i in range(pe_inputs):
+        pe_f = os.path.join(node_dir, "pengine", "pe-input-%d.bz2" % i)
+        with open(pe_f, 'w') as f:
+            f.write(bz2.compress(cib))
+        t = start + (end - start) * i / max(1, pe_inputs)
+        os.utime(pe_f, (t, t))
+
+def make_root(nodes, log_mb, pe_inputs):
+    root = tempfile.mkdtemp(prefix="hb_report_sim.")
+    bindir = os.path.join(root, "bin")
+    os.mkdir(bindir)
+    scripts = {"ssh": SSH, "hb_report": HB_REPORT}
+    for name in ("crm_mon", "cibadmin", "crm_node", "crm", "crmd"):
+        scripts[name] = STUB
+    for name, script in scripts.items():
+        path = os.path.join(bindir, name)
+        with open(path, 'w') as f:
+            f.write(script % {"python": sys.executable, "repo": REPO, "name": name})
+        os.chmod(path, 0755)
+    ocf_lib = os.path.join(root, "ocf", "lib", "heartbeat")
+    os.makedirs(ocf_lib)
+    with open(os.path.join(ocf_lib, "ocf-directories"), 'w') as f:
+        f.write(": ${HA_VARLIB:=%s}\n: ${HA_BIN:=%s}\n" % (os.path.join(root, "varlib"), bindir))
+    end = time.time()
+    start = end - 2 * 3600
+    for node in nodes:
+        make_node(root, node, nodes, log_mb, pe_inputs, start, end)
+    # where hb_report runs, not a node
+    os.makedirs(os.path.join(root, "master", "pengine"))
+    os.makedirs(os.path.join(root, "master", "cib"))
+    with open(os.path.join(root, "master", "corosync.conf"), 'w') as f:
+        f.write(COROSYNC_CONF % os.path.join(root, "master", "pacemaker.log"))
+    return root, start
+
+def run(nnodes, log_mb, pe_inputs, options, keep):
+    nodes = ["sim%02d" % (i + 1) for i in range(nnodes)]
+    root, start = make_root(nodes, log_mb, pe_inputs)
+    env = dict(os.environ)
+    env["PATH"] = "%s:%s" % (os.path.join(root, "bin"), env.get("PATH", ""))
+    env["HB_SIM_ROOT"] = root
+    env["HB_SIM_NODES"] = ' '.join(nodes)
+    dest = os.path.join(root, "report")
+    cmd = [os.path.join(root, "bin", "hb_report"), "-n", ' '.join(nodes),
+           "-f", time.strftime("%Y-%m-%d %H:%M", time.localtime(start + 1800)),
+           "-l", os.path.join(root, "%NODE%", "var/log/pacemaker.log"),
+           "-E", os.path.join(root, "%NODE%", "var/log/messages"),
+           "-Z"] + options + [dest]
+    t = time.time()
+    with open(os.devnull, 'w') as null:
+        code = subprocess.call(cmd, env=env, stdout=null, stderr=null if not keep else None)
+    wall = time.time() - t
+    sent = 0
+    if os.path.isfile(os.path.join(root, "bytes")):
+        sent = sum(int(line.split()[1]) for line in open(os.path.join(root, "bytes")))
+    report = [f for f in os.listdir(root) if f.startswith("report")]
+    result = {"nodes": nnodes,
+              "exit": code,
+              "wall_seconds": round(wall, 2),
+              "bytes_sent": sent,
+              "report_bytes": sum(os.path.getsize(os.path.join(root, f)) for f in report
+                                  if os.path.isfile(os.path.join(root, f))),
+              # of the largest process
+              "peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    if keep:
+        result["root"] = root
+    else:
+        shutil.rmtree(root)
+    return result
+
+def main(argv):
+    try:
+        opt, options = getopt.getopt(argv[1:], "n:s:p:kh")
+    except getopt.GetoptError:
+        print(__doc__)
+        return 1
+    sizes = [2, 4, 8]
+    log_mb = 4
+    pe_inputs = 50
+    keep = False
+    for args, option in opt:
+        if args == "-n":
+            sizes = [int(n) for n in option.split(',')]
+        if args == "-s":
+            log_mb = int(option)
+        if args == "-p":
+            pe_inputs = int(option)
+        if args == "-k":
+            keep = True
+        if args == "-h":
+            print(__doc__)
+            return 0
+    for n in sizes:
+        # a process per run, so that the peak RSS is of this run only
+        pid = os.fork()
+        if pid == 0:
+            print(json.dumps(run(n, log_mb, pe_inputs, options, keep), sort_keys=True))
+            sys.stdout.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
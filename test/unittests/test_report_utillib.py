@@ -1,11 +1,22 @@
 import sys
 sys.path.append("/usr/share/crmsh")
 import os
+import gzip
+import re
+import time
 
 from nose.tools import eq_, ok_
 from hb_report.utillib import which, ts_to_dt, sub_string, random_string,\
                               head, create_tempfile, tail, grep,\
-                              get_stamp_rfc5424, get_stamp_syslog
+                              get_stamp_rfc5424, get_stamp_syslog,\
+                              required_literals, compile_matcher, match_lines,\
+                              sub_string_test, log_view, view_lines,\
+                              view_last_lines, view_chunks, plan_logs,\
+                              parse_manifest, pe_seq, timings_summary,\
+                              txt_diff, ClusterProbe, parse_corosync_conf,\
+                              is_conf_set, get_conf_var, encode_manifests,\
+                              decode_manifests, since_arg, log_segment_size
+from hb_report import constants
 import crmsh.utils
 
 def get_command_info(cmd):
@@ -15,6 +26,73 @@ def get_command_info(cmd):
     else:
         return (code, "")
 
+def test_cluster_probe():
+    probe = ClusterProbe()
+    probe.facts = {"dc": "node1", "nodes": ["node1", "node2"], "crmd": True}
+    slave_probe = ClusterProbe()
+    slave_probe.load(probe.dump())
+    eq_(slave_probe.facts, {"dc": "node1", "nodes": ["node1", "node2"]})
+    eq_(slave_probe.get("dc"), "node1")
+    ClusterProbe().load("")
+
+def test_cluster_probe_hung():
+    class HungProbe(ClusterProbe):
+        def probe_dc(self):
+            time.sleep(5)
+            return "node1"
+    timeout = constants.PROBE_TIMEOUT
+    constants.PROBE_TIMEOUT = 0.2
+    try:
+        start = time.time()
+        eq_(HungProbe().get("dc"), None)
+        ok_(time.time() - start < 2)
+    finally:
+        constants.PROBE_TIMEOUT = timeout
+
+def test_corosync_conf():
+    conf = """# Please read the corosync.conf.5 manual page
+totem {
+    version: 2
+    interface {
+        ringnumber: 0
+        bindnetaddr: fe80::1
+    }
+}
+
+logging {
+    to_logfile: yes
+    logfile: /var/log/cluster/corosync.log
+    to_syslog: no
+    debug: off
+    logger_subsys {
+        subsys: QUORUM
+        debug: on
+    }
+}
+"""
+    tree = parse_corosync_conf(conf)
+    eq_(tree.get("totem.interface.bindnetaddr"), "fe80::1")
+    eq_(tree.get("totem.cluster_name", "none"), "none")
+    ok_(tree.is_set("logging.to_logfile"))
+    ok_(not tree.is_set("logging.to_syslog"))
+    eq_(tree.section("logging").section("logger_subsys", subsys="QUORUM").get("debug"), "on")
+
+    temp_file = create_tempfile()
+    with open(temp_file, 'w') as f:
+        f.write(conf)
+    conf_f = constants.CONF
+    constants.CONF = temp_file
+    try:
+        ok_(is_conf_set("to_logfile"))
+        ok_(not is_conf_set("debug"))
+        ok_(is_conf_set("debug", subsys="QUORUM"))
+        ok_(is_conf_set("to_logfile", subsys="QUORUM"))
+        eq_(get_conf_var("logfile"), "/var/log/cluster/corosync.log")
+        eq_(get_conf_var("syslog_facility", default="daemon"), "daemon")
+    finally:
+        constants.CONF = conf_f
+        os.remove(temp_file)
+
 def test_get_stamp_rfc5424():
     line = r"2017-01-26T11:04:19.562885+08:00 12sp2-4 kernel: [    0.000000]"
     ok_(get_stamp_rfc5424(line))      
@@ -56,9 +134,110 @@ some dddd
     os.remove(temp_file)
     eq_(out, '\n'.join(res))
 
+def test_log_segment_size():
+    text = "some aaa\n" * 300
+    temp_file = create_tempfile()
+    with open(temp_file, 'w') as f:
+        f.write(text)
+    gz_file = temp_file + ".gz"
+    f = gzip.open(gz_file, 'wb')
+    f.write(text)
+    f.close()
+    log_mmap = constants.LOG_MMAP
+    constants.LOG_MMAP = 0
+    try:
+        eq_(log_segment_size(temp_file, 0, 0), len(text))
+        eq_(log_segment_size(gz_file, 0, 0), os.path.getsize(gz_file) * constants.LOG_COMPRESS_RATIO)
+    finally:
+        constants.LOG_MMAP = log_mmap
+        os.remove(temp_file)
+        os.remove(gz_file)
+
+def test_log_view():
+    in_string = """some aaa
+some bbbb
+some cccc
+some dddd
+"""
+    temp_file = create_tempfile()
+    with open(temp_file, 'w') as f:
+        f.write(in_string)
+    view = log_view(temp_file)
+    eq_(list(view_lines(view)), in_string.split('\n')[:-1])
+    eq_(view_last_lines(view, 2), ["some dddd", "some cccc"])
+    eq_(list(view_chunks(view, size=20)),
+        ["some aaa\nsome bbbb\n", "some cccc\nsome dddd\n"])
+    os.remove(temp_file)
+
+def test_match_lines():
+    in_string = """crmd: NEW membership
+nothing here
+pcmk: lost: node1
+crmd: nothing
+"""
+    matcher = compile_matcher("crmd.*(NEW|LOST)|pcmk.*(lost|memb|LOST|MEMB):")
+    eq_(list(match_lines(matcher, in_string)),
+        [(1, "crmd: NEW membership"), (3, "pcmk: lost: node1")])
+    eq_(list(match_lines(matcher, in_string, invert=True)),
+        [(2, "nothing here"), (4, "crmd: nothing")])
+    matcher = compile_matcher("ERROR", re.I)
+    eq_(list(match_lines(matcher, "an error\nok\nlast Error", partial=True)),
+        [(1, "an error"), (3, "last Error")])
+
+def test_parse_manifest():
+    text = "node node1\nreport r2\nbase r1\nto_time 1500\n"\
+           "log ha-log.txt 2049 1234 8290\npe pe-input 3\n"\
+           "file cib.xml abc\nsame sysinfo.txt def\nappend ha-log.txt\n"
+    manifest = parse_manifest(text)
+    eq_(manifest["node"], "node1")
+    eq_(manifest["base"], "r1")
+    eq_(manifest["to_time"], 1500)
+    eq_(manifest["logs"], {"ha-log.txt": (2049, 1234, 8290)})
+    eq_(manifest["pe"], {"pe-input": 3})
+    eq_(manifest["files"], {"cib.xml": "abc", "sysinfo.txt": "def"})
+    eq_(manifest["append"], set(["ha-log.txt"]))
+
+def test_pe_seq():
+    eq_(pe_seq("/var/lib/pacemaker/pengine/pe-input-12.bz2"), ("pe-input", 12))
+    eq_(pe_seq("pe-warn-3.bz2"), ("pe-warn", 3))
+    eq_(pe_seq("pe-input.last"), None)
+
+def test_plan_logs():
+    temp_file = create_tempfile()
+    with open(temp_file, 'w') as f:
+        f.write("some aaa\n")
+    link = temp_file + ".link"
+    os.symlink(temp_file, link)
+    res = plan_logs([temp_file, link, temp_file, "/nonexistent/messages"])
+    os.remove(link)
+    os.remove(temp_file)
+    eq_(res, [(os.path.realpath(temp_file),
+               [os.path.basename(temp_file), os.path.basename(link)])])
+
 def test_random_string():
     eq_(len(random_string(8)), 8)
 
+def test_required_literals():
+    eq_(required_literals("CRIT:|ERROR:"), ["CRIT:", "ERROR:"])
+    eq_(required_literals("crmd.*(NEW|LOST)"), ["crmd"])
+    eq_(required_literals('name="passw.*|OSS"'), ["OSS\"", 'name="passw'])
+    eq_(required_literals("[0-9]+"), None)
+
+def test_since_arg():
+    manifests = {"node1": "node node1\nto_time 1500\n",
+                 "node2": "node node2\nto_time 1600\n",
+                 "node3": "node node3\nto_time 1700\n"}
+    since = constants.SINCE
+    constants.SINCE = encode_manifests(manifests)
+    try:
+        eq_(decode_manifests(constants.SINCE), manifests)
+        arg = since_arg(["node2", "node4"])
+        ok_(arg.startswith(" SINCE="))
+        eq_(decode_manifests(arg[len(" SINCE="):]), {"node2": manifests["node2"]})
+    finally:
+        constants.SINCE = since
+    eq_(since_arg(["node1"]), "")
+
 def test_sub_string():
     in_string = """
 some text some text
@@ -75,6 +254,8 @@ some number some number
 """
     pattern = "passw.* OSS"
     eq_(sub_string(in_string, pattern), out_string)
+    ok_(sub_string_test(in_string, pattern))
+    ok_(not sub_string_test(out_string, "user.*"))
 
 def test_tail():
     in_string = """some aaa
@@ -93,6 +274,20 @@ some dddd
     os.remove(temp_file)
     eq_(out, '\n'.join(res))
 
+def test_timings_summary():
+    usage = {"rss_kb": 100, "read_bytes": 1048576, "written_bytes": 0,
+             "processes": 1, "children_cpu": 0.5, "forks_avoided": 3}
+    get_log = {"name": "get_log", "start": 2.0, "seconds": 1.5}
+    get_log.update(usage)
+    timings = {"master": [{"name": "collect", "start": 1.0, "seconds": 10.0}],
+               "nodes": {"node1": [get_log,
+                                   {"name": "sys_info", "start": 3.0, "seconds": 2.0},
+                                   dict(get_log, start=5.0, seconds=0.5, rss_kb=50)]}}
+    lines = timings_summary(timings).split('\n')
+    eq_(lines[1].split(), ["master", "collect", "10.00"])
+    eq_(lines[2].split(), ["node1", "get_log", "2.00", "100", "2.0", "0.0", "2", "1.00", "6"])
+    eq_(lines[3].split(), ["node1", "sys_info", "2.00"])
+
 def test_ts_to_dt():
     ts1 = crmsh.utils.parse_to_timestamp("2pm")
     ts2 = crmsh.utils.parse_to_timestamp("2007/9/5 12:30")
@@ -104,6 +299,19 @@ def test_ts_to_dt():
     eq_(ts_to_dt(ts3).strftime("%-H:%M"), "1:00")
     eq_(ts_to_dt(ts4).strftime("%d-%b-%y %-H:%M"), "09-Sep-15 2:00")
 
+def test_txt_diff():
+    f1 = create_tempfile()
+    f2 = create_tempfile()
+    with open(f1, 'w') as f:
+        f.write("a\nb  c\n\nd\ne\nf\ng\nh\n")
+    with open(f2, 'w') as f:
+        f.write("a\nb c \nd\nE\nf\ng\nh\n")
+    res = txt_diff(f1, f2).split('\n')
+    eq_(txt_diff(f1, f1), "")
+    os.remove(f1)
+    os.remove(f2)
+    eq_(res[2:], ["@@ -1,8 +1,7 @@", " a", " b  c", "-", " d", "-e", "+E", " f", " g", " h", ""])
+
 def test_which():
     ok_(which("ls"))
     ok_(not which("llll"))
@@ -1,29 +1,350 @@
 # Copyright (C) 2017 Xin Liang <XLiang@suse.com>
 # See COPYING for license information.
+import base64
 import bz2
 import datetime
 import glob
 import gzip
-import multiprocessing
+import hashlib
+import itertools
+import mmap
 import os
 import pwd
 import random
 import re
+import resource
+import select
 import shutil
+import signal
+import sre_constants
+import sre_parse
 import stat
 import string
 import subprocess
 import sys
 import tempfile
+import thread
+import time
+import zlib
 import contextlib
-from dateutil import tz
-from threading import Timer
+# cProfile, dateutil, difflib, json, multiprocessing and threading are
+# imported where needed: a slave may not need them and has to start fast
 
 import constants
+# crmsh is needed right away by every slave: hb_report's load_env parses the
+# arguments with crmutils.nvpairs2dict, and the logging and writing of
+# the collected files go through crmmsg and crmutils.str2file
 import crmsh.config
 from crmsh import msg as crmmsg
 from crmsh import utils as crmutils
 
+_CONF_CACHE = {}
+_IO_BUDGET = [None, 0]
+_LOG_VIEWS = {}
+_MANIFEST = []
+_MATCHER_CACHE = {}
+_PROBE = []
+_SPAWN_LOCK = thread.allocate_lock()
+_WHICH_CACHE = {}
+# what check_env and compatibility_pcmk find out, cached across runs
+_ENV_CACHED = ("OCF_DIR", "HA_VARLIB", "HA_BIN", "CRM_DAEMON_DIR", "PE_STATE_DIR", "CIB_DIR")
+# what resource_usage returns, as the spans in TIMINGS_F name it
+_USAGE_KEYS = ("rss_kb", "read_bytes", "written_bytes", "processes", "children_cpu",
+               "forks_avoided")
+
+class ClusterProbe(object):
+    """
+    facts about the cluster, each found out once per process: when
+    first asked for, or in the background after prefetch; the cluster
+    wide ones (SHARED) are passed on to the slaves with dump and load,
+    so that they don't ask the daemons again
+    facts: crmd (running here), dc, nodes, local_ip and member_ip
+    """
+    SHARED = ("dc", "nodes", "member_ip")
+
+    def __init__(self):
+        self.facts = {}
+        self.threads = {}
+        self.late = set()
+
+    def get(self, name):
+        """
+        the fact name, or None if its probe doesn't answer within
+        PROBE_TIMEOUT (or the collector deadline); the probe runs in
+        a thread, so that a hung daemon can't hang us with it
+        """
+        if name in self.facts:
+            return self.facts[name]
+        self.prefetch(name)
+        timeout = constants.PROBE_TIMEOUT
+        if constants.DEADLINE:
+            timeout = min(timeout, max(0, constants.DEADLINE - time.time()))
+        if name in self.late:
+            # gave up on it once already, don't wait again
+            timeout = 0
+        self.threads[name].join(timeout)
+        if name not in self.facts and self.threads[name].is_alive():
+            if name not in self.late:
+                log_warning("%s of the cluster not found in %d seconds" % (name, timeout))
+            self.late.add(name)
+        return self.facts.get(name)
+
+    def prefetch(self, *names):
+        from threading import Thread
+        for name in names:
+            if name in self.facts or name in self.threads:
+                continue
+            t = Thread(target=self.fetch, args=(name,))
+            t.daemon = True
+            t.start()
+            self.threads[name] = t
+
+    def fetch(self, name):
+        self.facts[name] = getattr(self, "probe_" + name)()
+
+    def dump(self):
+        """
+        the shared facts known by now, packed for dump_env; those
+        still being found out are left to the slaves
+        """
+        out_string = ""
+        for name in self.SHARED:
+            if name in self.facts and self.facts[name] is not None:
+                value = self.facts[name]
+                if isinstance(value, list):
+                    value = ' '.join(value)
+                out_string += "%s %s\n" % (name, value)
+        return base64.urlsafe_b64encode(zlib.compress(out_string)).rstrip('=')
+
+    def load(self, data):
+        if not data:
+            return
+        text = zlib.decompress(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+        for line in text.split('\n'):
+            name, _, value = line.partition(' ')
+            if name in self.SHARED:
+                self.facts[name] = value if name == "dc" else value.split()
+
+    def probe_crmd(self):
+        return crmutils.is_process("crmd")
+
+    def probe_dc(self):
+        code, out, _ = get_stdout_stderr("crmadmin -D -t 1")
+        if code != 0 or not out.startswith("Designated"):
+            return None
+        return out.split()[-1]
+
+    def probe_local_ip(self):
+        ip_pattern = "[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
+        return [line.split()[2] for line in grep(ip_pattern, incmd="corosync-cfgtool -s")]
+
+    def probe_member_ip(self):
+        ip_pattern = "[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
+        res = []
+        for line in grep("runtime.*.srp.*.ip", incmd="corosync-cmapctl"):
+            res += re.findall(ip_pattern, line)
+        return res
+
+    def probe_nodes(self):
+        if self.get("crmd"):
+            cmd = "crm node server"
+        # if the cluster's stopped, try the CIB
+        else:
+            cmd = r"(CIB_file=%s/%s crm node server)" % (constants.CIB_DIR, constants.CIB_F)
+        return get_command_info(cmd)[1].strip().split('\n')
+
+class CollectorTimeout(Exception):
+    """
+    raised in a collector when its deadline has come (see arm_deadline)
+    """
+    pass
+
+class CorosyncConf(object):
+    """
+    a section of corosync.conf: its keys, the last value of a key
+    winning, and its subsections in order; the file is the top
+    section (see parse_corosync_conf and corosync_conf)
+    """
+    def __init__(self, name=""):
+        self.name = name
+        self.values = {}
+        self.sections = []
+
+    def subsections(self, name):
+        return [sect for sect in self.sections if sect.name == name]
+
+    def get(self, key, default=None):
+        """
+        the value of key; a dotted key is looked up in the first
+        subsections of those names, e.g. "logging.logfile"
+        """
+        sect = self
+        path = key.split('.')
+        for name in path[:-1]:
+            sect = sect.section(name)
+            if sect is None:
+                return default
+        return sect.values.get(path[-1], default)
+
+    def is_set(self, key, default=False):
+        """
+        whether key is on, yes, true or 1
+        """
+        value = self.get(key)
+        if value is None:
+            return default
+        return value.lower() in ("on", "yes", "true", "1")
+
+    def section(self, name, **match):
+        """
+        the first subsection name with the keys and values in match,
+        e.g. section("logger_subsys", subsys="pacemaker"); or None
+        """
+        for sect in self.subsections(name):
+            if all(sect.values.get(k) == v for k, v in match.items()):
+                return sect
+        return None
+
+class NodeJob(object):
+    """
+    a command run for node by run_jobs; its output is extracted into
+    WORKDIR as it arrives (extract) or thrown away; if it fails
+    without output, the command fallback(cmd) returns is tried, if any
+    state is one of waiting, running, done, failed and timeout
+    """
+    def __init__(self, node, cmd, timeout=None, extract=False, fallback=None):
+        self.node = node
+        self.cmd = cmd
+        self.timeout = timeout
+        self.extract = extract
+        self.fallback = fallback
+        self.interactive = False
+        self.state = "waiting"
+        self.code = None
+        self.nbytes = 0
+        self.err = ""
+        self.deadline = None
+        self.proc = None
+        self.tar = None
+
+    def start(self):
+        log_debug("%s: running %s" % (self.node, self.cmd))
+        self.state = "running"
+        self.started = time.time()
+        # once: the fallback command gets what is left of the time
+        if self.timeout and self.deadline is None:
+            self.deadline = time.time() + self.timeout
+        self.errf = tempfile.TemporaryFile()
+        with open(os.devnull, 'r+') as null:
+            # a group of its own, so that stopping the job stops what
+            # the shell started too; not if it needs the terminal
+            self.proc = spawn(self.cmd, shell=True, stdout=subprocess.PIPE,
+                              stderr=self.errf,
+                              stdin=None if self.interactive else null,
+                              preexec_fn=None if self.interactive else os.setsid)
+            if self.extract:
+                self.tar = spawn(["tar", "xf", "-"], cwd=constants.WORKDIR,
+                                 stdin=subprocess.PIPE, stderr=null)
+        return self.proc.stdout.fileno()
+
+    def feed(self, data):
+        self.nbytes += len(data)
+        if self.tar:
+            try:
+                self.tar.stdin.write(data)
+            except IOError:
+                pass
+
+    def finish(self, stopped=False):
+        """
+        wrap up after the command exited, or stop it; return True if
+        the job is to be run again with the fallback command
+        """
+        if stopped:
+            try:
+                if self.interactive:
+                    self.proc.kill()
+                else:
+                    os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.proc.wait()
+        self.proc.stdout.close()
+        if self.tar:
+            self.tar.stdin.close()
+            self.tar.wait()
+        self.errf.seek(0)
+        self.err = self.errf.read().strip()
+        self.errf.close()
+        if self.extract:
+            record_span("node:%s" % self.node, self.started, time.time() - self.started)
+        if stopped:
+            self.code = None
+            self.state = "timeout"
+            log_warning("no complete answer from %s in %d seconds; keeping partial data" % \
+                        (self.node, self.timeout))
+            if self.extract:
+                node_dir = os.path.join(constants.WORKDIR, self.node)
+                _mkdir(node_dir)
+                with open(os.path.join(node_dir, constants.INCOMPLETE_F), 'a') as f:
+                    f.write("no complete answer from the node in %d seconds; " % self.timeout)
+                    f.write("%d bytes received\n" % self.nbytes)
+            return False
+        self.code = self.proc.returncode
+        self.state = "done" if self.code == 0 else "failed"
+        log_debug("%s: %s (%d bytes)" % (self.node, self.state, self.nbytes))
+        if self.code != 0 and self.nbytes == 0 and self.fallback:
+            cmd = self.fallback(self.cmd)
+            self.fallback = None
+            if cmd:
+                if self.extract and self.err:
+                    log_warning(self.err)
+                self.cmd = cmd
+                self.state = "waiting"
+                return True
+        return False
+
+def _literals_of_seq(items):
+    """
+    walk a parsed regex sequence and return the best list of literals,
+    one of which must occur in every match; None if there is none
+    """
+    candidates = []
+    run = []
+    for op, av in items:
+        if op == sre_constants.LITERAL and av < 256:
+            run.append(chr(av))
+            continue
+        if run:
+            candidates.append([''.join(run)])
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            candidates.append(_literals_of_seq(av[-1]))
+        elif op == sre_constants.BRANCH:
+            alts = []
+            for branch in av[1]:
+                lits = _literals_of_seq(branch)
+                if not lits:
+                    alts = None
+                    break
+                alts += lits
+            candidates.append(alts)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            candidates.append(_literals_of_seq(av[2]))
+    if run:
+        candidates.append([''.join(run)])
+
+    best = None
+    for lits in candidates:
+        if not lits:
+            continue
+        score = (min(len(l) for l in lits), -len(lits))
+        if best is None or score > best[0]:
+            best = (score, lits)
+    if best is None:
+        return None
+    return best[1]
+
 def _mkdir(directory):
     """
     from crmsh/tmpfiles.py
@@ -34,6 +355,25 @@ def _mkdir(directory):
         except OSError as err:
             log_fatal("Failed to create directory: %s"%(err))
 
+def _sanitize_one(args):
+    """
+    worker of sanitize
+    """
+    return sanitize_one(*args)
+
+def _scan_range(args):
+    """
+    worker of scan_log: grep view[start:end] of logf for each pattern
+    """
+    logf, start, end, patterns, flags = args
+    view = log_view(logf)
+    matchers = [compile_matcher(p, flags) for p in patterns]
+    res = [[] for p in patterns]
+    for chunk in view_chunks(view, start, end):
+        for i, matcher in enumerate(matchers):
+            res[i] += [line for _, line in match_lines(matcher, chunk)]
+    return res
+
 def add_tmpfiles(contents):
     """
     add contents for removing when program exit
@@ -49,7 +389,7 @@ def arch_logs(logf, from_time, to_time):
     ret = []
     files = [logf]
     files += glob.glob(logf+"*[0-z9]")
-    for f in sorted(files, key=os.path.getctime):
+    for f in sorted(files, key=os.path.getmtime, reverse=True):
         res = is_our_log(f, from_time, to_time)
         if res == 0:
             continue
@@ -84,9 +424,11 @@ def analyze():
 
     out_string += "\n"
 
+    out_string = check_incomplete(workdir) + check_trimmed(workdir) + out_string
     out_string += check_crmvfy(workdir)
     out_string += check_backtraces(workdir)
     out_string += check_permissions(workdir)
+    out_string += check_plans(workdir)
     out_string += check_logs(workdir)
 
     analyze_f = os.path.join(workdir, constants.ANALYSIS_F)
@@ -107,15 +449,58 @@ def analyze_one(workdir, file_):
             node0 = n
     return (rc, out_string)
 
-def base_check():
-    if not which("which"):
-        log_fatal("please install the which(1) program")
+def arm_deadline(seconds):
+    """
+    raise CollectorTimeout in the collector after seconds, so that it
+    can still pack and send whatever it has collected by then
+    """
+    def expired(signum, frame):
+        raise CollectorTimeout()
+    constants.DEADLINE = time.time() + seconds
+    signal.signal(signal.SIGALRM, expired)
+    signal.alarm(max(1, int(seconds)))
 
 def booth_info():
     if not which("booth"):
         return ""
     return get_command_info("booth --version")[1]
 
+def build_id(exe):
+    """
+    GNU build-id of an ELF executable; None if it can't be read
+    """
+    if not exe or not which("readelf"):
+        return None
+    for line in grep("Build ID:", incmd="readelf -n %s" % exe):
+        return line.split()[-1]
+    return None
+
+def bt_cache_file(core, exe):
+    """
+    cache file for the backtrace of core; keyed by the core's path and
+    mtime and the build-id of the executable that dumped it
+    """
+    bt_dir = cache_dir("backtraces")
+    if not bt_dir:
+        return None
+    key = "%s %d %s" % (core, os.stat(core).st_mtime, build_id(exe) or exe)
+    return os.path.join(bt_dir, hashlib.sha1(key).hexdigest())
+
+def cache_dir(name):
+    """
+    directory name under CACHE_DIR, created if needed; None if that's
+    not possible (caching is best effort)
+    """
+    path = os.path.join(constants.CACHE_DIR, name)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, 0700)
+        except OSError:
+            return None
+    if not os.access(path, os.W_OK):
+        return None
+    return path
+
 def check_backtraces(workdir):
     out_string = ""
     pattern = "Core was generated|Program terminated"
@@ -138,7 +523,8 @@ def check_crmvfy(workdir):
 
 def check_env():   
     set_env()
-    base_check()
+    if load_env_cache():
+        return
     get_ocf_dir()
     load_ocf_dirs()
 
@@ -147,19 +533,61 @@ def check_if_log_is_empty():
         if os.stat(f).st_size == 0:
             log_warning("Report contains no logs; did you get the right timeframe?")
 
+def check_incomplete(workdir):
+    out_string = ""
+    for n in constants.NODES.split():
+        incomplete_f = os.path.join(workdir, n, constants.INCOMPLETE_F)
+        if os.path.isfile(incomplete_f):
+            out_string += "WARN: data collected at %s is incomplete:\n" % n
+            out_string += open(incomplete_f).read()
+    if out_string:
+        out_string += "\n"
+    return out_string
+
+def check_plans(workdir):
+    out_string = ""
+    for n in constants.NODES.split():
+        plan_f = os.path.join(workdir, n, constants.PLAN_F)
+        if not os.path.isfile(plan_f):
+            continue
+        for line in open(plan_f).read().split('\n'):
+            if line.startswith("skipped:"):
+                out_string += "INFO: to stay within the time budget, %s %s\n" % (n, line)
+    return out_string
+
+def check_trimmed(workdir):
+    out_string = ""
+    for n in constants.NODES.split():
+        trimmed_f = os.path.join(workdir, n, constants.TRIMMED_F)
+        if os.path.isfile(trimmed_f):
+            out_string += "WARN: data collected at %s was trimmed to the size limit:\n" % n
+            out_string += open(trimmed_f).read()
+    if out_string:
+        out_string += "\n"
+    return out_string
+
 def check_logs(workdir):
     out_string = ""
     log_list = []
     for l in constants.EXTRA_LOGS.split():
-        log_list += find_files_all(workdir, os.path.basename(l))
+        for f in find_files_all(os.path.basename(l), workdir):
+            if os.path.realpath(f) not in [os.path.realpath(x) for x in log_list]:
+                log_list.append(f)
     if not log_list:
         return out_string
 
     out_string += "Log patterns:\n"
     log_patterns = constants.LOG_PATTERNS.replace(' ', '|')
-    for n in constants.NODES.split():
-        for f in log_list:
-            out_string += '\n'.join(grep(log_patterns, infile=f))
+    sanitize_pattern = 'name="%s"' % re.sub(" ", "|", constants.SANITIZE)
+    sensitive = []
+    for f in log_list:
+        hits, secrets = scan_log(f, [log_patterns, sanitize_pattern])
+        if hits:
+            out_string += '\n'.join(hits) + '\n'
+        if secrets:
+            sensitive.append(f)
+    for f in sensitive:
+        out_string += "WARN: %s contains possibly sensitive data\n" % f
     return out_string
 
 def check_permissions(workdir):
@@ -227,80 +655,207 @@ def cib_diff(file1, file2):
 def cluster_info():
     return get_command_info("corosync -v")[1]
 
-def collect_info():
-    process_list = []
-    process_list.append(multiprocessing.Process(target=sys_info))
-    process_list.append(multiprocessing.Process(target=sys_stats))
-    process_list.append(multiprocessing.Process(target=get_pe_inputs))
-    process_list.append(multiprocessing.Process(target=crm_config))
-    process_list.append(multiprocessing.Process(target=touch_dc))
-
-    for p in process_list[0:2]:
-        p.start()
-    get_config()
-    for p in process_list[2:]:
-        p.start()
-
-    get_backtraces()
-    get_configurations()
-    check_perms()
-    dlm_dump()
-    time_status()
-    corosync_blackbox()
-    get_ratraces()
-
-    for p in process_list:
-        p.join()
-    if constants.SKIP_LVL == 0:
-        sanitize()
+def cluster_probe():
+    """
+    the ClusterProbe of this process
+    """
+    if not _PROBE:
+        _PROBE.append(ClusterProbe())
+    return _PROBE[0]
 
-    for l in constants.EXTRA_LOGS.split():
-        if not os.path.isfile(l):
-            continue
-        if l == constants.HA_LOG and l != constants.HALOG_F:
-            os.symlink(constants.HALOG_F, os.path.join(constants.WORKDIR, os.path.basename(l)))
-            continue
-        getstampproc = find_getstampproc(l)
-        if getstampproc:
+def collect_log(logf, name, outf):
+    """
+    dump the FROM_TIME..TO_TIME part of logf to outf, which is name
+    in the report, and note where it ended for a later --since-report;
+    for a delta report continue where the base report ended, if logf
+    is still the same file
+    """
+    with span("log:%s" % name):
+        end = log_end_offset(logf, constants.TO_TIME)
+        st = os.stat(logf)
+        base = None
+        if constants.DELTA_BASE:
+            base = constants.DELTA_BASE["logs"].get(name)
+        if base and end is not None and base[:2] == (st.st_dev, st.st_ino) and base[2] <= end:
+            log_debug("including bytes [%d-%d) of %s" % (base[2], end, logf))
+            with open(outf, 'w') as outfd:
+                write_view(outfd, log_view(logf), base[2], end)
+        elif not dump_recorded(logf, constants.FROM_TIME, constants.TO_TIME, outf):
+            dump_logset(logf, constants.FROM_TIME, constants.TO_TIME, outf)
+    if end is not None:
+        _MANIFEST.append("log %s %d %d %d" % (name, st.st_dev, st.st_ino, end))
+
+def collector_job(node, arg_str):
+    """
+    the NodeJob running the collector on node; a remote collector
+    that can't be reached is tried once more through a peer address
+    """
+    def by_peer_ip(cmd):
+        for ip in get_peer_ip():
+            log_info("Trying connect by %s" % ip)
+            return cmd.replace(node, ip, 1)
+        return None
+
+    if node == constants.WE:
+        cmd = r"hb_report __slave"
+        fallback = None
+    else:
+        cmd = r'ssh {} {} "{} hb_report __slave"'.\
+              format(constants.SSH_OPTS, node, constants.SUDO)
+        fallback = by_peer_ip
+    for item in arg_str.split():
+        cmd += " {}".format(str(item))
+    timeout = None
+    if constants.NODE_TIMEOUT and not node_needs_pwd(node):
+        timeout = constants.NODE_TIMEOUT
+    return NodeJob(node, cmd, timeout=timeout, extract=True, fallback=fallback)
+
+def collect_extra_logs():
+    halog_key = None
+    if constants.HA_LOG and os.path.isfile(os.path.join(constants.WORKDIR, constants.HALOG_F)):
+        halog_key = file_key(constants.HA_LOG)
+    # different logs may have the same basename
+    used = set(os.listdir(constants.WORKDIR))
+    for l, names in plan_logs(constants.EXTRA_LOGS.split()):
+        if file_key(l) == halog_key:
+            target = constants.HALOG_F
+        else:
+            getstampproc = find_getstampproc(l)
+            if not getstampproc:
+                log_warning("could not figure out the log format of %s" % l)
+                continue
             constants.GET_STAMP_FUNC = getstampproc
-            outf = os.path.join(constants.WORKDIR, os.path.basename(l))
-            dump_logset(l, constants.FROM_TIME, constants.TO_TIME, outf)
+            target = names.pop(0)
+            if target in used:
+                n = 1
+                while "%s-%d" % (target, n) in used:
+                    n += 1
+                target = "%s-%d" % (target, n)
+                log_warning("%s collected as %s, another log has its name" % (l, target))
+            used.update([target, target + ".info"])
+            outf = os.path.join(constants.WORKDIR, target)
+            collect_log(l, target, outf)
             log_size(l, outf+'.info')
-        else:
-            log_warning("could not figure out the log format of %s" % l)
+        for name in names:
+            if name == target:
+                continue
+            if name in used:
+                log_warning("%s not linked as %s, another log has that name" % (l, name))
+                continue
+            try:
+                os.symlink(target, os.path.join(constants.WORKDIR, name))
+            except OSError as err:
+                log_warning("cannot link %s to %s: %s" % (name, target, err))
+                continue
+            used.add(name)
+
+def collect_info():
+    # (collector, whether it runs in a process of its own); None
+    # waits for the processes started so far
+    if constants.BUDGET:
+        steps = plan_steps()
+    else:
+        steps = [(sys_info, True), (sys_stats, True), (get_config, False), (get_snapshots, False),
+                 (get_pe_inputs, True), (crm_config, True), (touch_dc, True),
+                 (get_backtraces, False), (get_configurations, False),
+                 (check_perms, False), (dlm_dump, False), (time_status, False),
+                 (corosync_blackbox, False), (get_ratraces, False), None]
+        if constants.SKIP_LVL == 0 or constants.DO_SANITIZE:
+            steps.append((sanitize, False))
+        steps.append((collect_extra_logs, False))
+    pending = [step[0].__name__ for step in steps if step]
+    if constants.DEADLINE and time.time() >= constants.DEADLINE:
+        mark_incomplete("the deadline passed before collecting", pending)
+        return
 
-def collect_journal(from_t, to_t, outf):
+    import multiprocessing
+    process_list = []
+    try:
+        for step in steps + [None]:
+            if step is None:
+                for p in process_list:
+                    p.join()
+                    if p.name in pending:
+                        pending.remove(p.name)
+                continue
+            func, own_process = step
+            if own_process:
+                p = multiprocessing.Process(target=run_step, args=(func, constants.PROFILE),
+                                            name=func.__name__)
+                p.start()
+                process_list.append(p)
+            else:
+                run_step(func)
+                pending.remove(func.__name__)
+    except CollectorTimeout:
+        disarm_deadline()
+        for p in process_list:
+            if p.is_alive():
+                p.terminate()
+            elif p.exitcode is not None and p.name in pending:
+                pending.remove(p.name)
+        if constants.DO_SANITIZE and "sanitize" in pending:
+            # with -s the CIB and PE inputs collected so far don't
+            # leave as they are
+            run_step(sanitize)
+            pending.remove("sanitize")
+        mark_incomplete("collection stopped at the %d seconds deadline" % constants.NODE_TIMEOUT, pending)
+
+def collect_journal(from_t, to_t, outf, cursor=None):
+    """
+    stream the journal of [from_t, to_t] into outf; with cursor, only
+    the entries after that cursor (e.g. the end of a previous report)
+    the cursor of the last entry is saved to JOURNAL_CURSOR_F next to
+    outf, so that a later report can resume from there
+    """
     if not which("journalctl"):
         log_warning("Command journalctl not found")
         return
 
     if crmutils.is_int(from_t) and from_t == 0:
-        from_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        from_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     elif crmutils.is_int(from_t):
-        from_time = ts_to_dt(from_t).strftime("%Y-%m-%d %H:%M")
+        from_time = ts_to_dt(from_t).strftime("%Y-%m-%d %H:%M:%S")
     if crmutils.is_int(to_t) and to_t == 0:
-        to_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        to_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     elif crmutils.is_int(to_t):
-        to_time = ts_to_dt(to_t).strftime("%Y-%m-%d %H:%M")
+        to_time = ts_to_dt(to_t).strftime("%Y-%m-%d %H:%M:%S")
     if os.path.isfile(outf):
         log_warning("%s already exists" % outf)
 
     log_debug("journalctl from: '%d' until: '%d' from_time: '%s' to_time: '%s' > %s" % \
              (from_t, to_t, from_time, to_time, outf))
-    cmd = 'journalctl -o short-iso --since "%s" --until "%s" --no-pager | tail -n +2' % \
-          (from_time, to_time)
-    crmutils.str2file(get_command_info(cmd)[1], outf)
+    cmd = ["journalctl", "-o", "short-iso", "--until", to_time, "--no-pager", "--show-cursor"]
+    if cursor:
+        cmd += ["--after-cursor", cursor]
+    else:
+        cmd += ["--since", from_time]
+    with open(outf, 'w') as fd, open(os.devnull, 'w') as err:
+        proc = spawn(cmd, stdout=subprocess.PIPE, stderr=err)
+        # drop the "-- Logs begin at ..." header
+        line = proc.stdout.readline()
+        if not line.startswith("-- "):
+            fd.write(line)
+        shutil.copyfileobj(proc.stdout, fd, 1024*1024)
+        proc.wait()
+
+    last_cursor = pop_journal_cursor(outf)
+    if last_cursor:
+        cursor_f = os.path.join(os.path.dirname(outf), constants.JOURNAL_CURSOR_F)
+        crmutils.str2file("%d %s\n" % (to_t, last_cursor), cursor_f)
 
 def compatibility_pcmk():     
-    get_crm_daemon_dir()      
-    if not constants.CRM_DAEMON_DIR:
-        log_fatal("cannot find pacemaker daemon directory!")
-    get_pe_state_dir()        
-    if not constants.PE_STATE_DIR:     
-        log_fatal("cannot find pe daemon directory!")
-    get_cib_dir()  
-    if not constants.CIB_DIR:
-        log_fatal("cannot find cib daemon directory!")
+    if not (constants.CRM_DAEMON_DIR and constants.PE_STATE_DIR and constants.CIB_DIR):
+        get_crm_daemon_dir()      
+        if not constants.CRM_DAEMON_DIR:
+            log_fatal("cannot find pacemaker daemon directory!")
+        get_pe_state_dir()        
+        if not constants.PE_STATE_DIR:     
+            log_fatal("cannot find pe daemon directory!")
+        get_cib_dir()  
+        if not constants.CIB_DIR:
+            log_fatal("cannot find cib daemon directory!")
+        save_env_cache()
 
     constants.PCMK_LIB = os.path.dirname(constants.CIB_DIR)
     log_debug("setting PCMK_LIB to %s" % constants.PCMK_LIB)
@@ -310,6 +865,25 @@ def compatibility_pcmk():
         constants.CORES_DIRS += " /var/lib/corosync"
     constants.B_CONF = os.path.basename(constants.CONF)
 
+def compile_matcher(pattern, flags=0):
+    """
+    compile pattern together with the literals one of which every
+    matching line must contain; match_lines and matcher_search use
+    them to reject lines with a plain substring search before
+    running the regex
+    returns (regex, literals, ignorecase); literals is None when the
+    pattern has no usable literal
+    """
+    key = (pattern, flags)
+    if key not in _MATCHER_CACHE:
+        regex = re.compile(pattern, flags)
+        nocase = bool(regex.flags & re.I)
+        literals = required_literals(pattern, flags)
+        if literals and nocase:
+            literals = sorted(set(l.lower() for l in literals))
+        _MATCHER_CACHE[key] = (regex, literals, nocase)
+    return _MATCHER_CACHE[key]
+
 def consolidate(workdir, f):
     for n in constants.NODES.split():
         if os.path.isfile(os.path.join(workdir, f)):
@@ -327,6 +901,21 @@ def corosync_blackbox():
         blackbox_f = os.path.join(constants.WORKDIR, constants.COROSYNC_RECORDER_F)
         crmutils.str2file(get_command_info("corosync-blackbox")[1], blackbox_f)
 
+def corosync_conf():
+    """
+    the parsed corosync.conf (CONF), parsed once for as long as the
+    file doesn't change; empty if there is none
+    """
+    try:
+        st = os.stat(constants.CONF)
+    except (OSError, TypeError):
+        return CorosyncConf()
+    sig = (st.st_ino, st.st_size, st.st_mtime)
+    if constants.CONF not in _CONF_CACHE or _CONF_CACHE[constants.CONF][0] != sig:
+        with open(constants.CONF, 'r') as f:
+            _CONF_CACHE[constants.CONF] = (sig, parse_corosync_conf(f.read()))
+    return _CONF_CACHE[constants.CONF][1]
+
 def create_tempfile(time=None):        
     random_str = random_string(4)  
     try:
@@ -337,11 +926,62 @@ def create_tempfile(time=None):
         os.utime(filename, (time, time))
     return filename
 
+def core_exe(core):
+    """
+    path of the program which dumped core, as reported by file(1)
+    """
+    out = get_command_info("file %s" % core)[1]
+    m = re.search("execfn: '([^']+)'", out) or re.search("from '([^' ]+)", out)
+    if not m:
+        return None
+    prog = m.group(1)
+    if os.path.isabs(prog):
+        return prog if is_exec(prog) else None
+    for d in [constants.CRM_DAEMON_DIR, constants.HA_BIN]:
+        if d and is_exec(os.path.join(d, prog)):
+            return os.path.join(d, prog)
+    return which(prog)
+
+def copy_throttled(src, dst):
+    """
+    copy file object src to dst in chunks, within BWLIMIT
+    """
+    while True:
+        data = src.read(1024*1024)
+        if not data:
+            break
+        dst.write(data)
+        throttle(len(data))
+
 def crm_config():
+    """
+    CIB_TXT_F, the CIB in crm shell syntax; rendered by crmsh in this
+    process (crm_config runs in one of its own), or by starting
+    crm configure show if that fails
+    """
     workdir = constants.WORKDIR
-    if os.path.isfile(os.path.join(workdir, constants.CIB_F)):
-        cmd = r"CIB_file=%s/%s crm configure show" % (workdir, constants.CIB_F)
-        crmutils.str2file(get_command_info(cmd)[1], os.path.join(workdir, constants.CIB_TXT_F))
+    cib_f = os.path.join(workdir, constants.CIB_F)
+    if not os.path.isfile(cib_f):
+        return
+    out_string = None
+    cib_env = os.environ.get("CIB_file")
+    os.environ["CIB_file"] = cib_f
+    try:
+        from crmsh import cibconfig
+        if cibconfig.cib_factory.initialize():
+            out_string = cibconfig.mkset_obj().repr() + '\n'
+            constants.FORKS_AVOIDED += 1
+    except Exception as err:
+        log_debug("crmsh could not render %s (%s); running crm" % (cib_f, err))
+    finally:
+        if cib_env is None:
+            del os.environ["CIB_file"]
+        else:
+            os.environ["CIB_file"] = cib_env
+    if out_string is None:
+        cmd = r"CIB_file=%s crm configure show" % cib_f
+        out_string = get_command_info(cmd)[1]
+    crmutils.str2file(out_string, os.path.join(workdir, constants.CIB_TXT_F))
 
 def crm_info():
     return get_command_info("%s/crmd version" % constants.CRM_DAEMON_DIR)[1]
@@ -364,6 +1004,13 @@ def diff_check(file1, file2):
     else:
         return (0, txt_diff(file1, file2))
 
+def disarm_deadline():
+    """
+    cancel the deadline of arm_deadline
+    """
+    signal.alarm(0)
+    constants.DEADLINE = 0
+
 def distro():
     ret = ""
     if which("lsb_release"):
@@ -391,6 +1038,32 @@ def dump_log(logf, from_line, to_line):
         return
     return filter_lines(logf, from_line, to_line)
 
+def decode_manifests(since):
+    """
+    the {node: manifest text} packed by encode_manifests
+    """
+    data = zlib.decompress(base64.urlsafe_b64decode(since + '=' * (-len(since) % 4)))
+    manifests = {}
+    for section in re.split("\n(?=node )", data):
+        node = parse_manifest(section)["node"]
+        if node:
+            manifests[node] = section.rstrip('\n') + '\n'
+    return manifests
+
+def decompress_log(logf):
+    """
+    start decompressing logf into a temporary file
+    return (process, tmpfile); (None, None) if logf is not compressed
+    """
+    if not re.search("(bz2|gz|xz)$", logf):
+        return (None, None)
+    tmp = create_tempfile()
+    add_tmpfiles(tmp)
+    with open(tmp, 'w') as out, open(os.devnull, 'w') as err:
+        proc = spawn(find_decompressor(logf).split() + [logf],
+                     stdout=out, stderr=err)
+    return (proc, tmp)
+
 def dump_logset(logf, from_time, to_time, outf):
     """
     find log/set of logs which are interesting for us
@@ -404,17 +1077,60 @@ def dump_logset(logf, from_time, to_time, outf):
     oldest = logf_set[-1]
     newest = logf_set[0]
     mid_logfiles = logf_set[1:-1]
-    out_string = ""
-    if num_logs == 1:
-        out_string += print_logseg(newest, from_time, to_time)
-    else:
-        out_string += print_logseg(oldest, from_time, 0)
-        for f in mid_logfiles:
-            out_string += print_log(f)
-            log_debug("including complete %s logfile" % f)
-        out_string += print_logseg(newest, 0, to_time)
+    with open(outf, 'w') as outfd:
+        if num_logs == 1:
+            print_logseg(newest, from_time, to_time, outfd)
+        else:
+            print_logseg(oldest, from_time, 0, outfd)
+            print_logs(mid_logfiles[::-1], outfd)
+            print_logseg(newest, 0, to_time, outfd)
 
-    crmutils.str2file(out_string, outf)
+def dump_profile(profiler, name):
+    """
+    --profile: stop profiler and write its statistics to PROFILE_F
+    in the work directory; they can be read with pstats
+    """
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(os.path.join(constants.WORKDIR, constants.PROFILE_F % name))
+
+def dump_recorded(logf, from_time, to_time, outf):
+    """
+    dump the from_time..to_time part of logf to outf from the flight
+    recorder's segments, and the part of logf the recorder hasn't
+    read yet; return False if the recorder doesn't cover that time
+    """
+    log_dir = recorder_log_dir(logf)
+    index = recorder_index(log_dir)
+    # 0 is a segment starting with lines without a time stamp, which
+    # may or may not cover from_time
+    if not index or (from_time and (not index[0][1] or index[0][1] > from_time)):
+        return False
+    log_debug("including %s from the flight recorder" % logf)
+    with open(outf, 'w') as outfd:
+        for n, first, last in index:
+            if last < from_time or (to_time and first > to_time):
+                continue
+            view = log_view(os.path.join(log_dir, "seg.%d" % n))
+            if view is None:
+                continue
+            start = 0
+            if from_time and first < from_time:
+                start = findpos_by_time(view, from_time)
+            end = len(view)
+            if to_time and last > to_time:
+                end = findpos_by_time(view, to_time, after=True)
+            if start is not None and end is not None:
+                write_view(outfd, view, start, end)
+        dev, ino, offset = [int(x) for x in open(os.path.join(log_dir, "state")).read().split()]
+        st = os.stat(logf)
+        view = log_view(logf)
+        if (st.st_dev, st.st_ino) == (dev, ino) and view is not None and offset < len(view) and \
+           (not to_time or index[-1][2] <= to_time):
+            end = log_end_offset(logf, to_time)
+            write_view(outfd, view, offset, max(offset, end))
+    return True
 
 def dump_state(workdir):
     res = grep("^Last upd", incmd="crm_mon -1", flag="v")
@@ -424,13 +1140,125 @@ def dump_state(workdir):
     cmd = "crm_node -p"
     crmutils.str2file(get_command_info(cmd)[1], os.path.join(workdir, constants.MEMBERSHIP_F))
 
+def encode_manifests(manifests):
+    """
+    pack the manifests of a report (see read_manifests) into a string
+    which can be passed to the slaves (see since_arg)
+    """
+    data = zlib.compress(''.join(manifests[n] for n in sorted(manifests)))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def env_cache_key():
+    """
+    what the environment found by check_env and compatibility_pcmk
+    depends on: the crmsh paths and the mtimes of crmd and of the OCF
+    directories file, so that an upgrade moving either invalidates
+    it; None if they can't be had
+    """
+    try:
+        paths = crmsh.config.path
+        key = [paths.ocf_root, paths.crm_daemon_dir, paths.pe_state_dir, paths.crm_config]
+        for f in ("%s/lib/heartbeat/ocf-directories" % paths.ocf_root,
+                  os.path.join(paths.crm_daemon_dir, "crmd")):
+            key.append("%d" % os.stat(f).st_mtime)
+    except (AttributeError, OSError):
+        return None
+    return ' '.join(str(k) for k in key)
+
+def estimate_collection():
+    """
+    --estimate: size up what this node would send for the time window
+    without collecting it, and write it to ESTIMATE_F
+    log segments are measured by bisecting the mapped logs; compressed
+    archives are scaled up by LOG_COMPRESS_RATIO
+    """
+    if not constants.HA_LOG:
+        # get_log, which finds it otherwise, doesn't run with --estimate
+        constants.HA_LOG = find_log()
+    log_files = []
+    if constants.HA_LOG and os.path.isfile(constants.HA_LOG):
+        log_files.append(os.path.realpath(constants.HA_LOG))
+    log_files += [l for l, _ in plan_logs(constants.EXTRA_LOGS.split()) if l not in log_files]
+    log_bytes = 0
+    nlogs = 0
+    compressed = 0
+    for l in log_files:
+        constants.GET_STAMP_FUNC = find_getstampproc(l)
+        if not constants.GET_STAMP_FUNC:
+            continue
+        for f in arch_logs(l, constants.FROM_TIME, constants.TO_TIME):
+            log_bytes += log_segment_size(f, constants.FROM_TIME, constants.TO_TIME)
+            nlogs += 1
+            if is_compressed(f):
+                compressed += 1
+
+    pe_files = [f for f in find_files(constants.PE_STATE_DIR, constants.FROM_TIME, constants.TO_TIME) or []
+                if not f.endswith(".last")]
+    pe_bytes = sum(os.path.getsize(f) for f in pe_files if os.path.isfile(f))
+    cores = [f for f in find_files(constants.CORES_DIRS, constants.FROM_TIME, constants.TO_TIME) or []
+             if re.search("core", os.path.basename(f))]
+
+    learned = learned_costs()
+    seconds = log_bytes / float(100*1024*1024)
+    for name in constants.COLLECTOR_VALUES:
+        if name in ("pe_to_dot", "verify_packages") and constants.SKIP_LVL:
+            continue
+        if name == "sanitize" and constants.SKIP_LVL and not constants.DO_SANITIZE:
+            continue
+        if name == "pe_to_dot" and len(pe_files) > 20:
+            continue
+        if name == "get_backtraces" and name not in learned:
+            seconds += len(cores) * constants.COLLECTOR_COSTS[name]
+            continue
+        seconds += estimate_cost(name, learned)
+
+    out_string = "log_files %d\n" % nlogs
+    out_string += "log_bytes %d\n" % log_bytes
+    out_string += "compressed_logs %d\n" % compressed
+    out_string += "pe_files %d\n" % len(pe_files)
+    out_string += "pe_bytes %d\n" % pe_bytes
+    out_string += "cores %d\n" % len(cores)
+    out_string += "seconds %d\n" % seconds
+    crmutils.str2file(out_string, os.path.join(constants.WORKDIR, constants.ESTIMATE_F))
+
+def estimate_report(workdir):
+    """
+    the table of the nodes' ESTIMATE_F for --estimate
+    """
+    out_string = "%-20s %12s %14s %8s %10s\n" % ("node", "logs", "PE inputs", "cores", "time")
+    total_bytes = 0
+    longest = 0
+    compressed = 0
+    for n in constants.NODES.split():
+        estimate_f = os.path.join(workdir, n, constants.ESTIMATE_F)
+        if not os.path.isfile(estimate_f):
+            out_string += "%-20s no estimate\n" % n
+            continue
+        est = {}
+        for line in open(estimate_f).read().split('\n'):
+            if line:
+                key, value = line.split()
+                est[key] = int(value)
+        total_bytes += est["log_bytes"] + est["pe_bytes"]
+        compressed += est.get("compressed_logs", 0)
+        longest = max(longest, est["seconds"])
+        out_string += "%-20s %9.1f MB %5d/%5.1f MB %8d %8ds\n" % \
+                      (n, est["log_bytes"]/1048576.0, est["pe_files"],
+                       est["pe_bytes"]/1048576.0, est["cores"], est["seconds"])
+    out_string += "total about %.1f MB before compression, about %d seconds\n" % \
+                  (total_bytes/1048576.0, longest)
+    if compressed:
+        out_string += "(%d compressed logs guessed at %d times their size)\n" % \
+                      (compressed, constants.LOG_COMPRESS_RATIO)
+    return out_string
+
 def events(destdir):
     events_f = os.path.join(destdir, "events.txt")
     out_string = ""
     pattern = '|'.join(constants.EVENT_PATTERNS.split()[1::2])
     halog_f = os.path.join(destdir, constants.HALOG_F)
     if os.path.isfile(halog_f):
-        out_string = '\n'.join(grep(pattern, infile=halog_f))
+        out_string = '\n'.join(scan_log(halog_f, [pattern])[0])
         crmutils.str2file(out_string, events_f)
         for n in constants.NODES.split():
             if os.path.isdir(os.path.join(destdir, n)):
@@ -442,10 +1270,26 @@ def events(destdir):
             halog_f = os.path.join(destdir, n, constants.HALOG_F)
             if not os.path.isfile(halog_f):
                 continue
-            out_string = '\n'.join(grep(pattern, infile=halog_f))
+            out_string = '\n'.join(scan_log(halog_f, [pattern])[0])
             crmutils.str2file(out_string, os.path.join(destdir, n, "events.text"))
 
+def estimate_cost(name, learned):
+    """
+    estimated seconds the collector name takes on this node: the
+    average of previous runs, or a guess from the size of its input
+    """
+    if name in learned:
+        return learned[name]
+    if name == "collect_extra_logs":
+        size = sum(os.path.getsize(l) for l in constants.EXTRA_LOGS.split() if os.path.isfile(l))
+        return 1 + size / float(100*1024*1024)
+    return constants.COLLECTOR_COSTS.get(name, 5)
+
 def find_decompressor(log_file):
+    """
+    the command to print log_file with: by its suffix, or else by
+    its first bytes; "echo" if it is neither compressed nor text
+    """
     decompressor = "echo"
     if re.search("bz2$", log_file):
         decompressor = "bzip2 -dc"
@@ -454,7 +1298,20 @@ def find_decompressor(log_file):
     elif re.search("xz$", log_file):
         decompressor = "xz -dc"
     else:
-        if re.search("text", get_command_info("file %s" % log_file)[1]):
+        # instead of asking file(1)
+        constants.FORKS_AVOIDED += 1
+        try:
+            with open(log_file, 'rb') as f:
+                head_ = f.read(4096)
+        except IOError:
+            return decompressor
+        if head_.startswith("BZh"):
+            decompressor = "bzip2 -dc"
+        elif head_.startswith("\x1f\x8b"):
+            decompressor = "gzip -dc"
+        elif head_.startswith("\xfd7zXZ\x00"):
+            decompressor = "xz -dc"
+        elif head_ and '\0' not in head_:
             decompressor = "cat"
     return decompressor
 
@@ -495,20 +1352,19 @@ def find_first_ts(data):
             break
     return ts
 
-def filter_lines(logf, from_line, to_line=None):
-    out_string = ""
-    if not to_line:
-        to_line = sum(1 for l in open(logf, 'r'))
+def file_key(path):
+    """
+    identity of the physical file behind path; None if it's missing
+    """
+    try:
+        stat_info = os.stat(path)
+    except OSError:
+        return None
+    return (stat_info.st_dev, stat_info.st_ino)
 
-    count = 1
+def filter_lines(logf, from_line, to_line=None):
     with open(logf, 'r') as f:
-        for line in f.readlines():
-            if count >= from_line and count <= to_line:
-                out_string += line
-            if count > to_line:
-                break
-            count += 1
-    return out_string
+        return ''.join(itertools.islice(f, from_line-1, to_line or None))
 
 def finalword():
     if constants.COMPRESS == 1:
@@ -578,26 +1434,27 @@ def find_ssh_user():
     else:
         try_user_list = constants.SSH_USER
 
-    for n in constants.NODES.split():
-        rc = 1
-        if n == constants.WE:
-            continue
-        for u in try_user_list.split():
-            if u != '__default':
-                ssh_s = '@'.join((u, n))
-            else:
-                ssh_s = n
-
-            if test_ssh_conn(ssh_s):
-                log_debug("ssh %s OK" % ssh_s)
-                ssh_user = u
-                try_user_list = u
-                rc = 0
-                break
-            else:
-                log_debug("ssh %s failed" % ssh_s)
-        if rc == 1:
-            constants.SSH_PASSWORD_NODES += " %s" % n
+    # probe all nodes at once with each user in turn, until one
+    # works for some node
+    nodes = [n for n in constants.NODES.split() if n != constants.WE]
+    failed = nodes
+    for u in try_user_list.split():
+        if not nodes:
+            break
+        jobs = []
+        for n in nodes:
+            ssh_s = n if u == '__default' else '@'.join((u, n))
+            cmd = r"ssh %s -T -o Batchmode=yes %s true" % (constants.SSH_OPTS, ssh_s)
+            jobs.append(NodeJob(n, cmd, timeout=60))
+        run_jobs(jobs)
+        for job in jobs:
+            log_debug("ssh %s %s" % (job.cmd.split()[-2], "OK" if job.code == 0 else "failed"))
+        if [job for job in jobs if job.code == 0]:
+            ssh_user = u
+            failed = [job.node for job in jobs if job.code != 0]
+            break
+    for n in failed:
+        constants.SSH_PASSWORD_NODES += " %s" % n
 
     if constants.SSH_PASSWORD_NODES:
         log_warning("passwordless ssh to node(s) %s does not work" % constants.SSH_PASSWORD_NODES)
@@ -606,6 +1463,32 @@ def find_ssh_user():
     if ssh_user != "__default":
         constants.SSH_USER = ssh_user
 
+def findpos_by_time(view, tm, after=False):
+    """
+    bisect a mapped log by byte offset; return the offset of the
+    first line stamped tm or later (later than tm if after), len(view)
+    if there is no such line, or None if no timestamps were found
+    lines without a timestamp stay with the stamped line before them
+    """
+    first = 0
+    last = len(view)
+    found = False
+    while first < last:
+        mid = view.rfind('\n', first, (first+last)/2) + 1
+        mid = max(first, mid)
+        ts, start, end = view_time(view, mid, last)
+        if ts is None:
+            last = mid
+            continue
+        found = True
+        if ts < tm or (after and ts == tm):
+            first = end
+        else:
+            last = start
+    if not found:
+        return None
+    return first
+
 def findln_by_time(logf, tm):
     tmid = None
     first = 1
@@ -645,7 +1528,7 @@ def findln_by_time(logf, tm):
 
 def get_backtraces():
     flist = []
-    for f in find_files(constants.CORES_DIRS, constants.FROM_TIME, constants.TO_TIME):
+    for f in find_files(constants.CORES_DIRS, constants.FROM_TIME, constants.TO_TIME) or []:
         bf = os.path.basename(f)
         if re.search("core", bf):
             flist.append(f)
@@ -653,6 +1536,62 @@ def get_backtraces():
         get_bt(flist)
         log_debug("found backtraces: %s" % ' '.join(flist))
 
+def get_bt(flist):
+    """
+    run gdb on the cores in flist, up to scan_workers() at a time and
+    each for at most BT_TIMEOUT seconds, appending the backtraces to
+    BT_F as they come in; cached backtraces are reused
+    """
+    if not which("gdb"):
+        log_warning("please install gdb to get backtraces")
+        return
+    bt_f = os.path.join(constants.WORKDIR, constants.BT_F)
+    queue = list(flist)
+    running = []
+    limit = max(1, scan_workers())
+    with open(bt_f, 'a') as outfd:
+        while queue or running:
+            while queue and len(running) < limit:
+                core = queue.pop(0)
+                exe = core_exe(core)
+                cache_f = bt_cache_file(core, exe)
+                header = "====== %s (%s) ======\n" % (core, exe or "unknown program")
+                if cache_f and os.path.isfile(cache_f):
+                    log_debug("using cached backtrace of %s" % core)
+                    outfd.write(header)
+                    with open(cache_f, 'r') as fd:
+                        shutil.copyfileobj(fd, outfd)
+                    continue
+                tmp = create_tempfile()
+                add_tmpfiles(tmp)
+                cmd = ["gdb", "-batch", "-n", "-quiet", "-ex", "thread apply all bt full", "-ex", "quit"]
+                cmd += [exe, core] if exe else ["-c", core]
+                with open(tmp, 'w') as out:
+                    proc = spawn(cmd, stdout=out, stderr=subprocess.STDOUT)
+                running.append((core, header, proc, tmp, cache_f, time.time() + constants.BT_TIMEOUT))
+            time.sleep(0.1)
+            for job in running[:]:
+                core, header, proc, tmp, cache_f, deadline = job
+                timed_out = False
+                if proc.poll() is None:
+                    if time.time() < deadline:
+                        continue
+                    proc.kill()
+                    proc.wait()
+                    log_warning("gdb timed out on %s" % core)
+                    timed_out = True
+                    cache_f = None
+                running.remove(job)
+                outfd.write(header)
+                with open(tmp, 'r') as fd:
+                    shutil.copyfileobj(fd, outfd)
+                if timed_out:
+                    outfd.write("gdb timed out after %d seconds\n" % constants.BT_TIMEOUT)
+                outfd.flush()
+                if cache_f:
+                    shutil.copy(tmp, cache_f)
+                os.remove(tmp)
+
 def get_cib_dir():
     try:
         constants.CIB_DIR = crmsh.config.path.crm_config
@@ -662,7 +1601,7 @@ def get_cib_dir():
         constants.CIB_DIR = None
 
 def get_command_info(cmd):
-    code, out, err = crmutils.get_stdout_stderr(cmd)
+    code, out, err = get_stdout_stderr(cmd)
     if out:
         return (code, out + '\n')  
     else:
@@ -670,8 +1609,9 @@ def get_command_info(cmd):
 
 def get_command_info_timeout(cmd, timeout=5):
     #Phthon 101: How to timeout a subprocess
+    from threading import Timer
     kill = lambda process: process.kill()
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    proc = spawn(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     my_timer = Timer(timeout, kill, [proc])
     try:
         my_timer.start()
@@ -684,19 +1624,18 @@ def get_command_info_timeout(cmd, timeout=5):
     else:
         return ""
 
-def get_conf_var(option, default=None):
-    ret = default
-    with open(constants.CONF, 'r') as f:
-        for line in f.read().split('\n'):
-            if re.match("^\s*%s\s*:"%option, line):
-                ret = line.split(':')[1].lstrip()
-    return ret
+def get_conf_var(option, default=None, section="logging"):
+    """
+    the value of option in section (dotted for a subsection, e.g.
+    "totem.interface") of corosync.conf
+    """
+    return corosync_conf().get("%s.%s" % (section, option), default)
 
 def get_config():
     workdir = constants.WORKDIR
     if os.path.isfile(constants.CONF):
         shutil.copy2(constants.CONF, workdir)
-    if crmutils.is_process("crmd"):
+    if cluster_probe().get("crmd"):
         dump_state(workdir)
         with open(os.path.join(workdir, "RUNNING"), 'w') as f:
             pass
@@ -732,11 +1671,7 @@ def get_dirname(path):
     return tmp
 
 def get_local_ip():
-    local_ip = []
-    ip_pattern = "[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
-    for line in grep(ip_pattern, incmd="corosync-cfgtool -s"):
-        local_ip.append(line.split()[2])
-    return local_ip
+    return list(cluster_probe().get("local_ip") or [])
 
 def get_log_vars():
     if is_conf_set("debug"):
@@ -755,14 +1690,9 @@ def get_nodes():
     # 1. set by user?
     if constants.USER_NODES:
         nodes = constants.USER_NODES.split()
-    # 2. running crm
-    elif crmutils.is_process("crmd"):
-        cmd = "crm node server"
-        nodes = get_command_info(cmd)[1].strip().split('\n')
-    # 3. if the cluster's stopped, try the CIB
+    # 2. running crm, or the CIB if the cluster's stopped
     else:
-        cmd = r"(CIB_file=%s/%s crm node server)" % (constants.CIB_DIR, constants.CIB_F)
-        nodes = get_command_info(cmd)[1].strip().split('\n')
+        nodes = list(cluster_probe().get("nodes") or [])
 
     return nodes
 
@@ -776,7 +1706,7 @@ def get_ratraces():
         flist.append(os.path.join("trace_ra", '/'.join(f.split('/')[-2:])))
     if flist:
         cmd = "tar -cf - -C `dirname %s` %s | tar -xf - -C %s" % (trace_dir, ' '.join(flist), constants.WORKDIR)
-        crmutils.ext_cmd(cmd)
+        spawn(cmd, shell=True).wait()
         log_debug("found %d RA trace files in %s" % (len(flist), trace_dir))
 
 def get_pe_inputs():
@@ -790,6 +1720,9 @@ def get_pe_inputs():
     for f in find_files(pe_dir, from_time, to_time):
         if re.search("[.]last$", f):
             continue
+        seq = pe_seq(f)
+        if constants.DELTA_BASE and seq and seq[1] <= constants.DELTA_BASE["pe"].get(seq[0], -1):
+            continue
         flist.append(f)
 
     if flist:
@@ -800,21 +1733,31 @@ def get_pe_inputs():
         log_debug("found %d pengine input files in %s" % (len(flist), pe_dir))
 
     if len(flist) <= 20:
-        if constants.SKIP_LVL == 0:
+        if constants.SKIP_LVL == 0 and not skipped("pe_to_dot"):
+            start = time.time()
             for f in flist:
                 pe_to_dot(os.path.join(flist_dir, os.path.basename(f)))
+            record_cost("pe_to_dot", time.time() - start)
     else:
         log_debug("too many PE inputs to create dot files")
 
+def get_snapshots():
+    """
+    the CIB and crm_mon snapshots the flight recorder took in the
+    report's time span
+    """
+    snap_dir = os.path.join(constants.CACHE_DIR, "recorder", "snapshots")
+    if not os.path.isdir(snap_dir):
+        return
+    to_time = constants.TO_TIME or time.time()
+    for ts in os.listdir(snap_dir):
+        if crmutils.is_int(ts) and constants.FROM_TIME <= int(ts) <= to_time:
+            shutil.copytree(os.path.join(snap_dir, ts),
+                            os.path.join(constants.WORKDIR, "snapshots", ts))
+
 def get_peer_ip():
     local_ip = get_local_ip()
-    peer_ip = []
-    ip_pattern = "[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
-    for line in grep("runtime.*.srp.*.ip", incmd="corosync-cmapctl"):
-        for ip in re.findall(ip_pattern, line):
-            if ip not in local_ip:
-                peer_ip.append(ip)
-    return peer_ip
+    return [ip for ip in (cluster_probe().get("member_ip") or []) if ip not in local_ip]
 
 def get_ocf_dir():
     ocf_dir = None
@@ -871,6 +1814,16 @@ def get_stamp_syslog(line):
         return None
     return res
 
+def get_stdout_stderr(cmd):
+    """
+    run the shell command cmd; return its exit code and its output
+    and errors, stripped
+    """
+    proc = spawn(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.strip(), err.strip()
+
 def get_ts(line):
     ts = None
     with stdchannel_redirected(sys.stderr, os.devnull):
@@ -911,14 +1864,21 @@ def grep(pattern, infile=None, incmd=None, flag=None):
 
 def grep_file(pattern, infile, flag):
     res = []
-    with open(infile, 'r') as fd:
-        res = grep_row(pattern, fd.read(), flag)
-        if res:
-            if flag and "l" in flag:
-                return [infile]
-        return res
+    view = log_view(infile)
+    if view is not None:
+        count = 0
+        for chunk in view_chunks(view):
+            res += grep_row(pattern, chunk, flag, count)
+            count += chunk.count('\n')
+    else:
+        with open(infile, 'r') as fd:
+            res = grep_row(pattern, fd.read(), flag)
+    if res:
+        if flag and "l" in flag:
+            return [infile]
+    return res
 
-def grep_row(pattern, indata, flag):
+def grep_row(pattern, indata, flag, offset=0):
     INVERT = False
     SHOWNUM = False
     reflag = 0
@@ -933,37 +1893,37 @@ def grep_row(pattern, indata, flag):
             SHOWNUM = True
 
     res = []
-    count = 0
-    for line in indata.split('\n')[:-1]:
-        count += 1
-        if re.search(pattern, line, reflag):
-            if not INVERT:
-                if SHOWNUM:
-                    res.append("%d:%s"%(count, line))
-                else:
-                    res.append(line)
-        elif INVERT:
-            if SHOWNUM:
-                res.append("%d:%s"%(count, line))
-            else:
-                res.append(line)
+    matcher = compile_matcher(pattern, reflag)
+    for count, line in match_lines(matcher, indata, INVERT):
+        if SHOWNUM:
+            res.append("%d:%s"%(count+offset, line))
+        else:
+            res.append(line)
     return res
 
 def head(n, indata):          
     return indata.split('\n')[:n]
 
+def is_compressed(logf):
+    """
+    whether logf is a compressed archive (not a text log)
+    """
+    return find_decompressor(logf) not in ("echo", "cat")
+
 def is_conf_set(option, subsys=None):
-    subsys_start = 0
-    with open(constants.CONF, 'r') as f:
-        for line in f.read().split('\n'):
-            if re.search("^\s*subsys\s*:\s*%s$" % subsys, line):
-                subsys_start = 1
-            if subsys_start == 1 and re.search("^\s*}", line):
-                subsys_start = 0
-            if re.match("^\s*%s\s*:\s*(on|yes)$" % option, line):
-                if not subsys or subsys_start == 1:
-                    return True
-    return False
+    """
+    whether option of the logging section of corosync.conf is on;
+    with subsys, as it applies to that subsystem: its logger_subsys
+    section overrides the logging section
+    """
+    logging = corosync_conf().section("logging")
+    if logging is None:
+        return False
+    if subsys:
+        sect = logging.section("logger_subsys", subsys=subsys)
+        if sect is not None and option in sect.values:
+            return sect.is_set(option)
+    return logging.is_set(option)
 
 def is_exec(filename):
     return os.path.isfile(filename) and os.access(filename, os.X_OK)
@@ -972,10 +1932,20 @@ def is_exec(filename):
 # check if the log contains a piece of our segment
 #
 def is_our_log(logf, from_time, to_time):
-    with open(logf, 'r') as fd:
-        data = fd.read()
-        first_time = find_first_ts(head(10, data))
-        last_time = find_first_ts(tail(10, data)[::-1])
+    view = log_view(logf)
+    if view is not None:
+        first_time = find_first_ts(itertools.islice(view_lines(view), 10))
+        last_time = find_first_ts(view_last_lines(view, 10))
+    elif re.search("(bz2|gz|xz)$", logf):
+        # rotated archives: the last entry was written when the
+        # log was rotated, so don't decompress all of it for that
+        first_time = find_first_ts(log_head(logf, 10))
+        last_time = os.stat(logf).st_mtime
+    else:
+        with open(logf, 'r') as fd:
+            data = fd.read()
+            first_time = find_first_ts(head(10, data))
+            last_time = find_first_ts(tail(10, data)[::-1])
 
     if (not first_time) or (not last_time):
         return 0 # skip (empty log?)
@@ -992,27 +1962,248 @@ def is_our_log(logf, from_time, to_time):
 def line_time(logf, line_num):
     ts = None
     with open(logf, 'r') as fd:
-        ts = get_ts(tail(line_num, fd.read())[0])
+        for line in itertools.islice(fd, line_num-1, line_num):
+            ts = get_ts(line.rstrip('\n'))
     return ts
 
-def load_ocf_dirs():
-    inf = "%s/lib/heartbeat/ocf-directories" % constants.OCF_DIR
-    if not os.path.isfile(inf):
-        log_fatal("file %s not exist" % inf)
-    constants.HA_VARLIB = grep("HA_VARLIB:=", infile=inf)[0].split(':=')[1].strip('}')
-    constants.HA_BIN = grep("HA_BIN:=", infile=inf)[0].split(':=')[1].strip('}')
-
-def log_debug(msg):           
-    if constants.VERBOSITY > 0 or crmsh.config.core.debug:
-        crmmsg.common_info("%s# %s" % (constants.WE, msg))
+def lower_priority():
+    """
+    low impact mode: run this process and whatever it starts with the
+    lowest CPU priority and idle I/O priority
+    """
+    try:
+        os.nice(19 - os.nice(0))
+    except OSError as err:
+        log_warning("cannot lower CPU priority: %s" % err)
+    if which("ionice"):
+        code, _ = get_command_info("ionice -c 3 -p %d" % os.getpid())
+        if code != 0:
+            log_warning("cannot set idle I/O priority")
+    log_debug("low impact mode: nice %d, idle I/O, %d worker(s), bwlimit %s" % \
+              (os.nice(0), scan_workers(), constants.BWLIMIT or "none"))
 
-def log_info(msg):
-    crmmsg.common_info("%s# %s" % (constants.WE, msg))
+def log_view(logf):
+    """
+    map an uncompressed log read-only and return the mmap object
+    views are cached per file, so that all scans of a log in this
+    process (time bisection, head/tail probes, segment dumps and
+    grep) share the same pages from the page cache instead of each
+    reading the file into a string
+    return None if LOG_MMAP is off or the file can't be mapped
+    """
+    if not constants.LOG_MMAP or re.search("(bz2|gz|xz)$", logf):
+        return None
+    try:
+        stat_info = os.stat(logf)
+    except OSError:
+        return None
+    if stat_info.st_size == 0 or not stat.S_ISREG(stat_info.st_mode):
+        return None
+    key = os.path.realpath(logf)
+    sig = (stat_info.st_dev, stat_info.st_ino, stat_info.st_size, stat_info.st_mtime)
+    if key in _LOG_VIEWS and _LOG_VIEWS[key][0] == sig:
+        return _LOG_VIEWS[key][1]
+    try:
+        with open(logf, 'rb') as fd:
+            view = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    _LOG_VIEWS[key] = (sig, view)
+    return view
 
-def log_fatal(msg):
-    crmmsg.common_err("%s# %s" % (constants.WE, msg))
+def learned_costs():
+    """
+    average time of the collectors over their last five runs, from
+    the timings record_cost keeps in CACHE_DIR
+    """
+    costs_dir = cache_dir("timings")
+    if not costs_dir or not os.path.isfile(os.path.join(costs_dir, "costs")):
+        return {}
+    costs_f = os.path.join(costs_dir, "costs")
+    history = {}
+    with open(costs_f, 'r') as f:
+        lines = f.read().split('\n')
+    for line in lines:
+        try:
+            name, seconds = line.split()
+            history.setdefault(name, []).append(float(seconds))
+        except ValueError:
+            continue
+    if len(lines) > 1000:
+        crmutils.str2file(''.join("%s %.2f\n" % (name, t) for name in history
+                                  for t in history[name][-5:]), costs_f)
+    return dict((name, sum(t[-5:]) / len(t[-5:])) for name, t in history.items())
+
+def link_duplicates(report_dir, nodes):
+    """
+    hard link the files which are the same in the directories of
+    nodes under report_dir, so that tar sends them once
+    """
+    seen = {}
+    saved = 0
+    for n in nodes:
+        for root, _, files in os.walk(os.path.join(report_dir, n)):
+            for f in files:
+                path = os.path.join(root, f)
+                if os.path.islink(path):
+                    continue
+                digest = hashlib.md5()
+                with open(path, 'rb') as fd:
+                    for chunk in iter(lambda: fd.read(1024*1024), ''):
+                        digest.update(chunk)
+                key = (os.path.getsize(path), digest.hexdigest())
+                if key not in seen:
+                    seen[key] = path
+                    continue
+                os.unlink(path)
+                os.link(seen[key], path)
+                saved += key[0]
+    log_debug("%d bytes of duplicates linked" % saved)
+
+def load_delta_base(since):
+    """
+    --since-report on a slave: find this node's manifest among the
+    encoded since and make it DELTA_BASE; FROM_TIME moves up to where
+    that report ended
+    """
+    text = decode_manifests(since).get(constants.WE)
+    if text:
+        manifest = parse_manifest(text)
+        constants.DELTA_BASE = manifest
+        if manifest["to_time"] > constants.FROM_TIME:
+            constants.FROM_TIME = manifest["to_time"]
+        log_debug("delta against %s, from %d" % (manifest["report"], constants.FROM_TIME))
+        return
+    log_warning("no data of %s in the base report; collecting everything" % constants.WE)
+
+def load_env_cache():
+    """
+    set the environment check_env and compatibility_pcmk find out from
+    what a previous run saved, if it still holds (the directories
+    pass the checks of the get_* functions); return True if so
+    """
+    key = env_cache_key()
+    env_dir = cache_dir("env")
+    if not key or not env_dir:
+        return False
+    try:
+        lines = open(os.path.join(env_dir, "env")).read().split('\n')
+    except IOError:
+        return False
+    if lines[0] != key:
+        return False
+    values = dict(l.split('=', 1) for l in lines[1:] if '=' in l)
+    if sorted(values) != sorted(_ENV_CACHED):
+        return False
+    for name in ("OCF_DIR", "CRM_DAEMON_DIR", "PE_STATE_DIR", "CIB_DIR"):
+        if not os.path.isdir(values[name]):
+            return False
+    if not is_exec(os.path.join(values["CRM_DAEMON_DIR"], "crmd")) or \
+       not os.path.isfile("%s/lib/heartbeat/ocf-directories" % values["OCF_DIR"]):
+        return False
+    for name in _ENV_CACHED:
+        setattr(constants, name, values[name])
+    log_debug("environment from the cache: %s" % ' '.join("%s=%s" % (n, values[n]) for n in _ENV_CACHED))
+    return True
+
+def load_ocf_dirs():
+    inf = "%s/lib/heartbeat/ocf-directories" % constants.OCF_DIR
+    if not os.path.isfile(inf):
+        log_fatal("file %s not exist" % inf)
+    with open(inf, 'r') as f:
+        values = dict(re.findall(r"\$\{(\w+):=([^}]*)\}", f.read()))
+    for name in ("HA_VARLIB", "HA_BIN"):
+        if name not in values:
+            log_fatal("cannot find %s in %s" % (name, inf))
+        setattr(constants, name, values[name])
+
+def log_debug(msg):           
+    if constants.VERBOSITY > 0 or crmsh.config.core.debug:
+        crmmsg.common_info("%s# %s" % (constants.WE, msg))
+
+def log_end_offset(logf, to_time):
+    """
+    offset in logf just past to_time (or the end if to_time is 0);
+    None if logf can't be mapped
+    """
+    view = log_view(logf)
+    if view is None:
+        return None
+    if not to_time:
+        return len(view)
+    pos = findpos_by_time(view, to_time, after=True)
+    if pos is None:
+        return len(view)
+    return pos
+
+def log_head(logf, n):
+    """
+    first n lines of a compressed log; the decompressor is stopped
+    as soon as they are read
+    """
+    with open(os.devnull, 'w') as err:
+        proc = spawn(find_decompressor(logf).split() + [logf],
+                     stdout=subprocess.PIPE, stderr=err)
+    try:
+        res = [line.rstrip('\n') for line in itertools.islice(proc.stdout, n)]
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+    return res
+
+def log_info(msg):
+    crmmsg.common_info("%s# %s" % (constants.WE, msg))
+
+def log_fatal(msg):
+    crmmsg.common_err("%s# %s" % (constants.WE, msg))
     sys.exit(1)
 
+def log_peak(logf):
+    """
+    offset of the busiest part of logf: the middle of the stretch
+    (1/256 of the log, at least 64k) with the most LOG_PATTERNS
+    matches, or the end if nothing matched
+    """
+    view = log_view(logf)
+    if view is None:
+        return os.path.getsize(logf)
+    matcher = compile_matcher(constants.LOG_PATTERNS.replace(' ', '|'))
+    stretch = max(1 << 16, len(view) >> 8)
+    hits = {}
+    offset = 0
+    for chunk in view_chunks(view):
+        for start, _ in match_spans(matcher, chunk, partial=True):
+            n = (offset + start) / stretch
+            hits[n] = hits.get(n, 0) + 1
+        offset += len(chunk)
+    if not hits:
+        return len(view)
+    busiest = max(sorted(hits), key=lambda n: hits[n])
+    return min(len(view), busiest * stretch + stretch / 2)
+
+def log_segment_size(logf, from_time, to_time):
+    """
+    bytes of logf between from_time and to_time, or the file size
+    if it can't be mapped; a compressed archive counts whole, as
+    LOG_COMPRESS_RATIO times its size
+    """
+    view = log_view(logf)
+    if view is None:
+        if is_compressed(logf):
+            return os.path.getsize(logf) * constants.LOG_COMPRESS_RATIO
+        return os.path.getsize(logf)
+    from_pos = 0
+    if from_time:
+        from_pos = findpos_by_time(view, from_time)
+    to_pos = len(view)
+    if to_time:
+        to_pos = findpos_by_time(view, to_time, after=True)
+    if from_pos is None or to_pos is None:
+        return len(view)
+    return max(0, to_pos - from_pos)
+
 def log_size(logf, outf):
     l_size = os.stat(logf).st_size + 1
     out_string = "%s %d" % (logf, l_size)
@@ -1026,6 +2217,156 @@ def make_temp_dir():
     _mkdir(dir_path)          
     return dir_path
 
+def match_lines(matcher, indata, invert=False, partial=False):
+    """
+    yield (line_number, line) for the newline terminated lines of
+    indata which are matched by matcher (not matched if invert);
+    with partial, a trailing unterminated line is considered too
+    """
+    limit = len(indata) if partial else indata.rfind('\n') + 1
+    count = 1
+    pos = 0
+    for start, end in match_spans(matcher, indata, partial):
+        if invert:
+            for line in indata[pos:start].split('\n')[:-1]:
+                yield count, line
+                count += 1
+        else:
+            count += indata.count('\n', pos, start)
+            yield count, indata[start:end]
+        count += 1
+        pos = end + 1
+    if invert and pos < limit:
+        lines = indata[pos:limit].split('\n')
+        if indata[limit-1] == '\n':
+            lines.pop()
+        for line in lines:
+            yield count, line
+            count += 1
+
+def match_spans(matcher, indata, partial=False):
+    """
+    yield (start, end) offsets of the lines of indata matched by
+    matcher, end being the offset of the terminating newline; see
+    match_lines for partial
+    candidate lines are located by searching the whole buffer for
+    the matcher's literals, so lines without any are skipped
+    without being split out or passed to the regex
+    """
+    regex, literals, nocase = matcher
+    end = len(indata) if partial else indata.rfind('\n') + 1
+    pos = 0
+    if literals is None:
+        while pos < end:
+            nl = indata.find('\n', pos, end)
+            line_end = end if nl == -1 else nl
+            if regex.search(indata[pos:line_end]):
+                yield (pos, line_end)
+            pos = line_end + 1
+        return
+
+    hay = indata.lower() if nocase else indata
+    nexts = dict((l, hay.find(l, 0, end)) for l in literals)
+    while pos < end:
+        cand = end
+        for lit in literals:
+            i = nexts[lit]
+            if 0 <= i < pos:
+                i = hay.find(lit, pos, end)
+                nexts[lit] = i
+            if i != -1 and i < cand:
+                cand = i
+        if cand == end:
+            break
+        line_start = max(pos, hay.rfind('\n', pos, cand) + 1)
+        nl = indata.find('\n', cand, end)
+        line_end = end if nl == -1 else nl
+        if regex.search(indata[line_start:line_end]):
+            yield (line_start, line_end)
+        pos = line_end + 1
+
+def matcher_search(matcher, line):
+    """
+    like regex.search(line), but reject lines that contain none of
+    the matcher's literals without running the regex
+    """
+    regex, literals, nocase = matcher
+    if literals is not None:
+        hay = line.lower() if nocase else line
+        for lit in literals:
+            if lit in hay:
+                break
+        else:
+            return None
+    return regex.search(line)
+
+def mark_incomplete(reason, steps=None):
+    """
+    note in INCOMPLETE_F why and what of this node's data is missing
+    """
+    log_warning(reason)
+    with open(os.path.join(constants.WORKDIR, constants.INCOMPLETE_F), 'a') as f:
+        f.write("%s\n" % reason)
+        if steps:
+            f.write("not collected: %s\n" % ' '.join(steps))
+
+def merge_reports(base, delta, tmpdir):
+    """
+    --merge: rebuild a full report in WORKDIR from the report base and
+    the delta made with --since-report base; what the delta doesn't
+    have is taken from base, and its logs are appended to those of
+    base; return the nodes of the report
+    FROM_TIME and TO_TIME are set to the span of the merged report
+    """
+    base_top = unpack_report(base, os.path.join(tmpdir, "base"))
+    delta_top = unpack_report(delta, os.path.join(tmpdir, "delta"))
+    shutil.copytree(delta_top, constants.WORKDIR, symlinks=True)
+    nodes = []
+    for n in sorted(os.listdir(constants.WORKDIR)):
+        node_dir = os.path.join(constants.WORKDIR, n)
+        manifest_f = os.path.join(node_dir, constants.MANIFEST_F)
+        if not os.path.isfile(manifest_f):
+            continue
+        nodes.append(n)
+        manifest = parse_manifest(open(manifest_f).read())
+        if not constants.FROM_TIME or manifest["from_time"] < constants.FROM_TIME:
+            constants.FROM_TIME = manifest["from_time"]
+        constants.TO_TIME = max(constants.TO_TIME, manifest["to_time"])
+        base_dir = os.path.join(base_top, n)
+        base_manifest_f = os.path.join(base_dir, constants.MANIFEST_F)
+        if not os.path.isfile(base_manifest_f):
+            log_warning("%s has no data of %s" % (base, n))
+            continue
+        if parse_manifest(open(base_manifest_f).read())["report"] != manifest["base"]:
+            log_warning("%s at %s was not made against %s" % (delta, n, base))
+        for root, _, files in os.walk(base_dir):
+            for f in files:
+                src = os.path.join(root, f)
+                rel = os.path.relpath(src, base_dir)
+                dst = os.path.join(node_dir, rel)
+                if rel in manifest["append"] and os.path.isfile(dst):
+                    fd, tmp = tempfile.mkstemp(dir=node_dir)
+                    with os.fdopen(fd, 'w') as outfd:
+                        for part in (src, dst):
+                            with open(part, 'r') as infd:
+                                shutil.copyfileobj(infd, outfd, 1024*1024)
+                    os.rename(tmp, dst)
+                elif not os.path.lexists(dst):
+                    _mkdir(os.path.dirname(dst))
+                    if os.path.islink(src):
+                        os.symlink(os.readlink(src), dst)
+                    else:
+                        shutil.copy2(src, dst)
+        # the merged report is a full one, a base for later deltas
+        out_string = ""
+        for line in open(manifest_f).read().split('\n'):
+            if line.startswith("same "):
+                out_string += "file " + line[5:] + '\n'
+            elif line and not line.startswith("append ") and not line.startswith("base "):
+                out_string += line + '\n'
+        crmutils.str2file(out_string, manifest_f)
+    return nodes
+
 def mktemplate(argv):
     workdir = constants.WORKDIR
     out_string = constants.EMAIL_TMPLATE.format("%s"%date(), ' '.join(argv[1:]))
@@ -1049,10 +2390,68 @@ def node_needs_pwd(node):
             return True
     return False
 
+def parse_corosync_conf(text):
+    """
+    the CorosyncConf tree of corosync.conf text: "name {" opens a
+    section, "}" closes it, "key: value" sets a key; # comments
+    and unbalanced braces are tolerated
+    """
+    top = CorosyncConf()
+    stack = [top]
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.endswith('{'):
+            sect = CorosyncConf(line[:-1].strip())
+            stack[-1].sections.append(sect)
+            stack.append(sect)
+        elif line == '}':
+            if len(stack) > 1:
+                stack.pop()
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            stack[-1].values[key.strip()] = value.strip()
+    return top
+
+def parse_manifest(text):
+    """
+    the manifest written by write_manifest as a dict
+    """
+    manifest = {"node": None, "report": None, "base": None, "from_time": 0, "to_time": 0,
+                "journal": None, "logs": {}, "pe": {}, "files": {}, "append": set()}
+    for line in text.split('\n'):
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        if fields[0] in ("node", "report", "base", "journal"):
+            manifest[fields[0]] = line.split(None, 1)[1]
+        elif fields[0] in ("from_time", "to_time"):
+            manifest[fields[0]] = int(fields[1])
+        elif fields[0] == "log":
+            manifest["logs"][fields[1]] = tuple(int(x) for x in fields[2:5])
+        elif fields[0] == "pe":
+            manifest["pe"][fields[1]] = int(fields[2])
+        elif fields[0] in ("file", "same"):
+            manifest["files"][fields[1]] = fields[2]
+        elif fields[0] == "append":
+            manifest["append"].add(fields[1])
+    return manifest
+
+def pe_seq(pe_file):
+    """
+    (series, sequence number) of a PE input, e.g. ("pe-input", 12)
+    for pe-input-12.bz2; None if pe_file isn't named like one
+    """
+    res = re.match(r"(pe-\w+)-(\d+)\.", os.path.basename(pe_file))
+    if not res:
+        return None
+    return res.group(1), int(res.group(2))
+
 def pe_to_dot(pe_file):
     dotf = '.'.join(pe_file.split('.')[:-1]) + '.dot'
     cmd = "%s -D %s -x %s" % (constants.PTEST, dotf, pe_file)
-    code, _ = crmutils.get_stdout(cmd)
+    code = get_stdout_stderr(cmd)[0]
     if code != 0:
         log_warning("pe_to_dot: %s -> %s failed" % (pe_file, dotf))
 
@@ -1120,19 +2519,174 @@ def pkg_versions(packages):
     if pkg_mgr == "pkginfo":
         return pkg_ver_pkginfo(packages)
 
-def print_log(logf):
+def plan_logs(logs):
+    """
+    map the requested logs onto the physical files behind them, so
+    that a file is time-searched and dumped once however many names,
+    symlinks or hardlinks refer to it
+    return [(path, names)] in the order of logs: path is the resolved
+    file, whose rotation chain is searched, and names the distinct
+    basenames the requested logs are collected under
+    """
+    plan = []
+    index = {}
+    for l in logs:
+        key = file_key(l)
+        if not key or not os.path.isfile(l):
+            continue
+        name = os.path.basename(l)
+        if key not in index:
+            index[key] = len(plan)
+            plan.append((os.path.realpath(l), [name]))
+        elif name not in plan[index[key]][1]:
+            plan[index[key]][1].append(name)
+            log_debug("%s is the same file as %s" % (l, plan[index[key]][0]))
+    return plan
+
+def pool_map(func, args, workers, chunksize=None):
+    """
+    map func over args in a pool of workers processes; past the
+    deadline (see arm_deadline) the pool is terminated and
+    CollectorTimeout raised, as the alarm can't interrupt pool.map
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = pool.map_async(func, args, chunksize)
+        if constants.DEADLINE:
+            try:
+                results = pending.get(max(1, constants.DEADLINE - time.time()))
+            except multiprocessing.TimeoutError:
+                raise CollectorTimeout()
+        else:
+            results = pending.get()
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return results
+
+def pop_journal_cursor(journal_f):
+    """
+    remove the "-- cursor: ..." line journalctl --show-cursor appends
+    to journal_f and return the cursor; None if there is none
+    """
+    mark = "-- cursor: "
+    with open(journal_f, 'r+') as fd:
+        fd.seek(0, 2)
+        start = max(0, fd.tell() - 4096)
+        fd.seek(start)
+        data = fd.read()
+        pos = data.rfind(mark)
+        if pos == -1 or (pos > 0 and data[pos-1] != '\n') or (pos == 0 and start > 0):
+            return None
+        fd.truncate(start + pos)
+    return data[pos+len(mark):].strip()
+
+def plan_steps():
+    """
+    budget mode: pick the collect_info steps for the time left of
+    BUDGET; the must-haves (CIB, crm_mon, the logs and, with -s,
+    sanitize) first, then the optional collectors with the most value
+    per estimated second as long as they fit; the rest is skipped and
+    noted in PLAN_F
+    """
+    left = constants.BUDGET - (time.time() - constants.START_TIME)
+    left -= max(5, constants.BUDGET / 10)
+    learned = learned_costs()
+    collectors = {"check_perms": check_perms, "corosync_blackbox": corosync_blackbox,
+                  "crm_config": crm_config, "dlm_dump": dlm_dump,
+                  "get_backtraces": get_backtraces, "get_configurations": get_configurations,
+                  "get_pe_inputs": get_pe_inputs, "get_ratraces": get_ratraces,
+                  "sys_info": sys_info, "sys_stats": sys_stats,
+                  "time_status": time_status, "touch_dc": touch_dc}
+    own_process = {"sys_info": True, "sys_stats": True, "get_pe_inputs": True,
+                   "crm_config": True, "touch_dc": True}
+    parents = {"pe_to_dot": "get_pe_inputs", "verify_packages": "sys_info"}
+    steps = [(get_config, False), (get_snapshots, False), (collect_extra_logs, False)]
+    for func, _ in steps:
+        left -= estimate_cost(func.__name__, learned)
+    # with -s the CIB and PE inputs never leave unsanitized
+    if constants.DO_SANITIZE:
+        left -= estimate_cost("sanitize", learned)
+
+    names = [n for n in constants.COLLECTOR_VALUES
+             if n != "sanitize" or (constants.SKIP_LVL == 0 and not constants.DO_SANITIZE)]
+    names.sort(key=lambda n: constants.COLLECTOR_VALUES[n] / max(0.1, estimate_cost(n, learned)),
+               reverse=True)
+    chosen = []
+    skipped = []
+    for name in names:
+        cost = estimate_cost(name, learned)
+        if cost <= left and parents.get(name, name) not in skipped:
+            chosen.append(name)
+            left -= cost
+        else:
+            skipped.append(name)
+    constants.SKIPPED_STEPS = skipped
+
+    for name in chosen:
+        if name not in parents and name != "sanitize":
+            steps.append((collectors[name], own_process.get(name, False)))
+    steps.append(None)
+    if constants.DO_SANITIZE:
+        chosen.append("sanitize")
+    if "sanitize" in chosen:
+        steps.append((sanitize, False))
+
+    out_string = "budget: %d seconds\n" % constants.BUDGET
+    out_string += "collected: get_log %s %s\n" % \
+                  (' '.join(func.__name__ for func, _ in steps[:3]), ' '.join(chosen))
+    if skipped:
+        out_string += "skipped: %s\n" % ' '.join(skipped)
+    crmutils.str2file(out_string, os.path.join(constants.WORKDIR, constants.PLAN_F))
+    log_debug("budget plan: %s" % ' '.join(chosen))
+    return steps
+
+def print_log(logf, outfd):
+    view = log_view(logf)
+    if view is not None:
+        write_view(outfd, view, 0, len(view))
+        return
     cat = find_decompressor(logf)
     cmd = "%s %s" % (cat, logf)
-    _. out = crmutils.get_stdout(cmd)
-    return out
+    out = get_stdout_stderr(cmd)[1]
+    outfd.write(out + '\n')
+    throttle(len(out))
 
-def print_logseg(logf, from_time, to_time):
+def print_logs(logfs, outfd):
+    """
+    write the complete logs logfs to outfd in the given order
+    compressed logs are decompressed concurrently into temporary
+    files by up to scan_workers() decompressors, read ahead of the
+    log being written out
+    """
+    queue = list(logfs)
+    pending = []
+    limit = max(1, scan_workers())
+    while queue or pending:
+        while queue and len(pending) < limit:
+            f = queue.pop(0)
+            pending.append((f,) + decompress_log(f))
+        f, proc, tmp = pending.pop(0)
+        if proc is None:
+            print_log(f, outfd)
+        else:
+            if proc.wait() != 0:
+                log_warning("failed to decompress %s" % f)
+            with open(tmp, 'r') as fd:
+                copy_throttled(fd, outfd)
+            os.remove(tmp)
+        log_debug("including complete %s logfile" % f)
+
+def print_logseg(logf, from_time, to_time, outfd):
     cat = find_decompressor(logf)
     if cat != "cat":
         tmp = create_tempfile()
         add_tmpfiles(tmp)
         cmd = "%s %s > %s" % (cat, logf, tmp)
-        code, out, err = crmutils.get_stdout_stderr(cmd)
+        code, out, err = get_stdout_stderr(cmd)
         if code != 0:
             log_fatal("maybe disk full: %s" % err)
         sourcef = tmp
@@ -1140,6 +2694,25 @@ def print_logseg(logf, from_time, to_time):
         sourcef = logf
         tmp = ""
 
+    view = log_view(sourcef)
+    if view is not None:
+        from_pos = 0
+        if from_time != 0:
+            from_pos = findpos_by_time(view, from_time)
+            if from_pos is None:
+                log_warning("couldn't find line for time %d; corrupt log file?" % from_time)
+                return
+        to_pos = len(view)
+        if to_time != 0:
+            to_pos = findpos_by_time(view, to_time, after=True)
+            if to_pos is None:
+                log_warning("couldn't find line for time %d; corrupt log file?" % to_time)
+                return
+        log_debug("including segment [%d-%d) bytes from %s" % (from_pos, to_pos, sourcef))
+        if from_pos < to_pos:
+            write_view(outfd, view, from_pos, to_pos)
+        return
+
     if from_time == 0:
         FROM_LINE = 1
     else:
@@ -1157,7 +2730,9 @@ def print_logseg(logf, from_time, to_time):
             return
 
     log_debug("including segment [%s-%s] from %s" % (FROM_LINE, TO_LINE, sourcef))
-    return dump_log(sourcef, FROM_LINE, TO_LINE)
+    out = dump_log(sourcef, FROM_LINE, TO_LINE)
+    outfd.write(out)
+    throttle(len(out))
 
 def ra_build_info():
     inf = "%s/lib/heartbeat/ocf-shellfuncs" % constants.OCF_DIR
@@ -1173,24 +2748,379 @@ def random_string(num):
         tmp = random.sample(s, num)
     return ''.join(tmp)
 
+def required_literals(pattern, flags=0):
+    """
+    return a list of literal strings such that every string matched
+    by pattern contains at least one of them; None if the pattern
+    does not have such literals (e.g. "[0-9]+")
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    literals = _literals_of_seq(parsed)
+    if not literals or '' in literals:
+        return None
+    return sorted(set(literals))
+
+def read_manifests(path):
+    """
+    the manifests of the previous report path for --since-report,
+    as {node: manifest text}; path is a report tarball or directory,
+    or a single manifest
+    """
+    if os.path.isdir(path):
+        flist = glob.glob(os.path.join(path, "*", constants.MANIFEST_F))
+    elif os.path.basename(path) == constants.MANIFEST_F:
+        flist = [path]
+    else:
+        tmpdir = tempfile.mkdtemp()
+        add_tmpfiles(tmpdir)
+        cmd = "tar -xf %s -C %s --wildcards '*/%s'" % (path, tmpdir, constants.MANIFEST_F)
+        code, _, err = get_stdout_stderr(cmd)
+        if code != 0:
+            log_fatal("could not read the manifests of %s: %s" % (path, err))
+        flist = glob.glob(os.path.join(tmpdir, "*", "*", constants.MANIFEST_F))
+    manifests = {}
+    for f in flist:
+        text = open(f).read()
+        node = parse_manifest(text)["node"]
+        if node:
+            manifests[node] = text
+    if not manifests:
+        log_fatal("%s has no manifests; was it made by this version?" % path)
+    return manifests
+
+def record_cost(name, seconds):
+    """
+    remember how long the collector name took, for estimate_cost
+    """
+    costs_dir = cache_dir("timings")
+    if not costs_dir:
+        return
+    try:
+        with open(os.path.join(costs_dir, "costs"), 'a') as f:
+            f.write("%s %.2f\n" % (name, seconds))
+    except IOError:
+        pass
+
+def record_log(logf, log_dir, limit):
+    """
+    flight recorder: append the lines added to logf since the last
+    poll to its segments in log_dir, and drop the oldest segments
+    beyond limit bytes; the rest of a rotated logf is read first,
+    if it is still there and not compressed
+    """
+    st = os.stat(logf)
+    state_f = os.path.join(log_dir, "state")
+    if os.path.isfile(state_f):
+        dev, ino, offset = [int(x) for x in open(state_f).read().split()]
+    else:
+        # start with the latest limit bytes
+        dev, ino, offset = st.st_dev, st.st_ino, max(0, st.st_size - limit)
+        if offset:
+            with open(logf, 'r') as fd:
+                fd.seek(offset)
+                offset += len(fd.readline())
+    if (dev, ino) != (st.st_dev, st.st_ino):
+        for f in glob.glob(logf + "*"):
+            fst = os.stat(f)
+            if (fst.st_dev, fst.st_ino) == (dev, ino) and find_decompressor(f) == "cat":
+                record_lines(f, log_dir, offset)
+        offset = 0
+    elif offset > st.st_size:
+        offset = 0
+    offset = record_lines(logf, log_dir, offset)
+    crmutils.str2file("%d %d %d" % (st.st_dev, st.st_ino, offset), state_f)
+
+    index = recorder_index(log_dir)
+    size = sum(os.path.getsize(os.path.join(log_dir, "seg.%d" % n)) for n, _, _ in index)
+    while len(index) > 1 and size > limit:
+        seg = os.path.join(log_dir, "seg.%d" % index[0][0])
+        size -= os.path.getsize(seg)
+        os.unlink(seg)
+        index.pop(0)
+    crmutils.str2file(''.join("%d %d %d\n" % tuple(e) for e in index),
+                      os.path.join(log_dir, "index"))
+
+def record_lines(logf, log_dir, offset):
+    """
+    append the complete lines of logf from offset on to the newest
+    segment in log_dir, starting a new one at RECORDER_SEGMENT bytes,
+    and keep the index of their time stamps; return the offset after
+    the last line
+    """
+    index = recorder_index(log_dir)
+    with open(logf, 'r') as fd:
+        fd.seek(offset)
+        while True:
+            chunk = fd.read(constants.RECORDER_SEGMENT)
+            data = chunk[:chunk.rfind('\n') + 1]
+            if not data and len(chunk) == constants.RECORDER_SEGMENT:
+                # a line longer than a segment: keep its start, skip the rest
+                skipped = skip_line(fd)
+                if skipped is None:
+                    break
+                log_warning("%s: line at offset %d cut at %d bytes" % (logf, offset, len(chunk)))
+                data = chunk + '\n'
+                offset += len(chunk) + skipped
+            elif not data:
+                break
+            else:
+                offset += len(data)
+            fd.seek(offset)
+            lines = data.split('\n')
+            first = get_ts(lines[0]) or 0
+            last = get_ts(lines[-2]) or first
+            if not index or \
+               os.path.getsize(os.path.join(log_dir, "seg.%d" % index[-1][0])) >= constants.RECORDER_SEGMENT:
+                index.append([index[-1][0] + 1 if index else 0, first, last])
+            else:
+                if not index[-1][1]:
+                    index[-1][1] = first
+                if last:
+                    index[-1][2] = last
+            with open(os.path.join(log_dir, "seg.%d" % index[-1][0]), 'a') as segfd:
+                segfd.write(data)
+    crmutils.str2file(''.join("%d %d %d\n" % tuple(e) for e in index),
+                      os.path.join(log_dir, "index"))
+    return offset
+
+def record_snapshots(snap_dir):
+    """
+    flight recorder: keep the CIB, crm_mon and membership if they
+    changed since the last snapshot, up to RECORDER_SNAPSHOTS
+    """
+    tmp = tempfile.mkdtemp(dir=snap_dir)
+    dump_state(tmp)
+    snapshots = sorted((int(ts) for ts in os.listdir(snap_dir) if crmutils.is_int(ts)))
+    if snapshots:
+        last = os.path.join(snap_dir, str(snapshots[-1]))
+        if all(open(os.path.join(tmp, f)).read() == open(os.path.join(last, f)).read()
+               for f in os.listdir(tmp) if os.path.isfile(os.path.join(last, f))):
+            shutil.rmtree(tmp)
+            return
+    os.rename(tmp, os.path.join(snap_dir, "%d" % time.time()))
+    for ts in snapshots[:max(0, len(snapshots) + 1 - constants.RECORDER_SNAPSHOTS)]:
+        shutil.rmtree(os.path.join(snap_dir, str(ts)))
+
+def record_span(name, start, seconds, usage=None):
+    """
+    append a span, with what it used (see resource_usage) if known, to
+    SPANS_F in the work directory; all processes of this run append
+    to the same file, which a slave sends along
+    """
+    line = "%s %.3f %.3f" % (name, start, seconds)
+    if usage:
+        line += " %d %d %d %d %.2f %d" % tuple(usage)
+    try:
+        with open(os.path.join(constants.WORKDIR, constants.SPANS_F), 'a') as f:
+            f.write(line + '\n')
+    except IOError:
+        pass
+
+def recorder_index(log_dir):
+    """
+    the flight recorder's index of log_dir, [[segment, first_ts,
+    last_ts], ...] oldest first; empty if the recorder isn't running
+    """
+    index_f = os.path.join(log_dir, "index")
+    heartbeat = os.path.join(constants.CACHE_DIR, "recorder", "heartbeat")
+    if not os.path.isfile(index_f) or not os.path.isfile(heartbeat) or \
+       time.time() - os.path.getmtime(heartbeat) > 3 * constants.RECORDER_INTERVAL:
+        return []
+    return [[int(x) for x in line.split()] for line in open(index_f).read().split('\n') if line]
+
+def recorder_log_dir(logf):
+    return os.path.join(constants.CACHE_DIR, "recorder", os.path.realpath(logf).strip('/').replace('/', '_'))
+
+def relay_groups(nodes, relays):
+    """
+    split nodes into relays groups of neighbouring names (which often
+    share a site or rack); the first node of a group is its relay
+    """
+    nodes = sorted(nodes)
+    size = (len(nodes) + relays - 1) / relays
+    return [nodes[i:i+size] for i in range(0, len(nodes), size)]
+
+def report_priority(name):
+    """
+    for --max-size: how early name in WORKDIR is given up; CIB,
+    crm_mon, membership and the other small status files (0) are
+    always kept, then come the ha-log (1), the other logs (2), the PE
+    inputs (3), sysstats (4), backtraces and RA traces (5)
+    """
+    if name == constants.HALOG_F:
+        return 1
+    if name == constants.JOURNAL_F or \
+       name in [os.path.basename(l) for l in constants.EXTRA_LOGS.split()]:
+        return 2
+    if constants.PE_STATE_DIR and name == os.path.basename(constants.PE_STATE_DIR):
+        return 3
+    if name == constants.SYSSTATS_F:
+        return 4
+    if name in (constants.BT_F, "trace_ra"):
+        return 5
+    return 0
+
+def resource_usage():
+    """
+    what this process used so far: peak RSS in KB, bytes read and
+    written, processes started, CPU seconds of the children waited
+    for and processes not started thanks to in-process replacements
+    """
+    io = {}
+    if os.path.isfile("/proc/self/io"):
+        with open("/proc/self/io", 'r') as f:
+            for line in f:
+                k, v = line.split(':')
+                io[k] = int(v)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, io.get("rchar", 0),
+            io.get("wchar", 0), constants.SPAWNED, children.ru_utime + children.ru_stime,
+            constants.FORKS_AVOIDED)
+
+def run_recorder():
+    """
+    --daemon: the flight recorder; keep the latest RECORDER_SIZE bytes
+    of the logs in segments under CACHE_DIR, indexed by time, and
+    snapshots of the cluster state, so that a report can take them
+    from there instead of searching the rotated logs
+    """
+    rec_dir = cache_dir("recorder")
+    if not rec_dir:
+        log_fatal("cannot write to %s" % constants.CACHE_DIR)
+    snap_dir = os.path.join(rec_dir, "snapshots")
+    _mkdir(snap_dir)
+    if not constants.HA_LOG:
+        constants.HA_LOG = find_log()
+    stamp_funcs = {}
+    for l, _ in plan_logs([constants.HA_LOG] + constants.EXTRA_LOGS.split()):
+        func = find_getstampproc(l)
+        if func:
+            stamp_funcs[l] = func
+            _mkdir(recorder_log_dir(l))
+        else:
+            log_warning("could not figure out the log format of %s" % l)
+    if not stamp_funcs:
+        log_fatal("no logs to record")
+    lower_priority()
+    log_info("recording %s in %s" % (' '.join(sorted(stamp_funcs)), rec_dir))
+    heartbeat = os.path.join(rec_dir, "heartbeat")
+    while True:
+        for l, func in stamp_funcs.items():
+            constants.GET_STAMP_FUNC = func
+            try:
+                record_log(l, recorder_log_dir(l), constants.RECORDER_SIZE / len(stamp_funcs))
+            except EnvironmentError as err:
+                log_debug("cannot record %s: %s" % (l, err))
+        record_snapshots(snap_dir)
+        crmutils.str2file("%d\n" % time.time(), heartbeat)
+        time.sleep(constants.RECORDER_INTERVAL)
+
+def run_jobs(jobs, limit=None):
+    """
+    run jobs (NodeJob) from this process, at most limit (MAX_JOBS)
+    at a time, waiting on all their outputs with select; on a
+    terminal, the number of nodes in each state is shown as it goes
+    """
+    limit = limit or constants.MAX_JOBS
+    waiting = list(jobs)
+    running = {}
+    shown = 0
+    while waiting or running:
+        while waiting and len(running) < limit:
+            job = waiting.pop(0)
+            running[job.start()] = job
+        try:
+            ready = select.select(list(running), [], [], 1)[0]
+        except select.error:
+            continue
+        for fd in ready:
+            job = running[fd]
+            data = os.read(fd, 65536)
+            if data:
+                job.feed(data)
+                continue
+            del running[fd]
+            if job.finish():
+                waiting.insert(0, job)
+        now = time.time()
+        for fd, job in running.items():
+            if job.deadline and now >= job.deadline:
+                del running[fd]
+                job.finish(stopped=True)
+        if len(jobs) > 1 and sys.stderr.isatty() and now - shown >= 1:
+            show_jobs(jobs)
+            shown = now
+    if shown:
+        show_jobs(jobs)
+        sys.stderr.write('\n')
+
+def run_step(func, profile=False):
+    start = time.time()
+    profiler = start_profile() if profile else None
+    with span(func.__name__):
+        func()
+    dump_profile(profiler, func.__name__)
+    record_cost(func.__name__, time.time() - start)
+
+def sample_dir(path, keep):
+    """
+    remove files from directory path, evenly spread and sparing the
+    newest, until about keep bytes are left; return the number of
+    files kept and removed
+    """
+    files = sorted(os.listdir(path), key=lambda f: os.path.getmtime(os.path.join(path, f)))
+    size = sum(os.path.getsize(os.path.join(path, f)) for f in files)
+    if not files or size <= keep:
+        return len(files), 0
+    nkeep = len(files) * keep / size
+    kept = set(files[-1 - i * len(files) / nkeep] for i in range(nkeep)) if nkeep else set()
+    for f in files:
+        if f not in kept:
+            os.unlink(os.path.join(path, f))
+    return len(kept), len(files) - len(kept)
+
 def sanitize():
     workdir = constants.WORKDIR
     conf = os.path.join(workdir, constants.B_CONF)
     if os.path.isfile(conf):
         sanitize_one(conf)
     cib_f = os.path.join(workdir, constants.CIB_F)
-    rc = 0
-    for f in [cib_f] + glob.glob(os.path.join(workdir, "pengine", "*")):
-        if os.path.isfile(f):
-            if constants.DO_SANITIZE == 1:
-                sanitize_one(f)
-            else:
-                rc = sanitize_one(f, "test")
+    mode = None if constants.DO_SANITIZE == 1 else "test"
+    args = [(f, mode) for f in [cib_f] + glob.glob(os.path.join(workdir, "pengine", "*"))
+            if os.path.isfile(f)]
+    workers = min(scan_workers(), len(args) / 16 + 1)
+    if workers > 1:
+        results = pool_map(_sanitize_one, args, workers, 16)
+    else:
+        results = [_sanitize_one(arg) for arg in args]
+    rc = 1 if mode == "test" and any(results) else 0
     if rc != 0:
         log_warning("some PE or CIB files contain possibly sensitive data")
         log_warning("you may not want to send this report to a public mailing list")
 
+def sanitize_chunks(fd):
+    """
+    read a (decompressed) file object in chunks ending on a line
+    boundary
+    """
+    while True:
+        chunk = fd.read(1024*1024)
+        if not chunk:
+            break
+        if not chunk.endswith('\n'):
+            chunk += fd.readline()
+        yield chunk
+
 def sanitize_one(in_file, mode=None):
+    """
+    in "test" mode return 1 if in_file contains sensitive data;
+    otherwise rewrite it with the values obfuscated, streaming from
+    the decompressor through sub_string into the compressor
+    files without a sensitive attribute are not rewritten
+    """
     open_ = None
     if re.search("gz$", in_file):
         open_ = gzip.open
@@ -1198,23 +3128,49 @@ def sanitize_one(in_file, mode=None):
         open_ = bz2.BZ2File
     else:
         open_ = open
-    with open_(in_file, 'r') as f:
-        data = f.read()
+    matcher = compile_matcher('name="%s"' % re.sub(" ", "|", constants.SANITIZE))
 
+    found = False
+    with open_(in_file, 'r') as f:
+        for chunk in sanitize_chunks(f):
+            for _ in match_spans(matcher, chunk, partial=True):
+                found = True
+                break
+            if found:
+                break
     if mode == "test":
-        if sub_string_test(data):
+        if found:
             return 1
         else:
             return 0
-
-    ref = create_tempfile()
-    add_tmpfiles(ref)
-    touch_r(in_file, ref)
-
-    with open_(in_file, 'w') as f:
-        f.write(sub_string(data))
-
-    touch_r(ref, in_file)
+    if not found:
+        return 0
+
+    # in_file may be a symlink to the original PE input; replace the
+    # link instead of writing through it
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(in_file), prefix=".sanitize.")
+    os.close(fd)
+    add_tmpfiles(tmp)
+    with open_(in_file, 'r') as f, open_(tmp, 'w') as out:
+        for chunk in sanitize_chunks(f):
+            out.write(sub_string(chunk, constants.SANITIZE))
+    shutil.copymode(in_file, tmp)
+    touch_r(in_file, tmp)
+    os.rename(tmp, in_file)
+    return 0
+
+def save_env_cache():
+    """
+    save what check_env and compatibility_pcmk found out for the next
+    runs (see load_env_cache)
+    """
+    key = env_cache_key()
+    env_dir = cache_dir("env")
+    if not key or not env_dir:
+        return
+    out_string = key + '\n'
+    out_string += ''.join("%s=%s\n" % (n, getattr(constants, n)) for n in _ENV_CACHED)
+    crmutils.str2file(out_string, os.path.join(env_dir, "env"))
 
 def say_ssh_user():
     if not constants.SSH_USER:
@@ -1222,6 +3178,80 @@ def say_ssh_user():
     else:
         return constants.SSH_USER
 
+def scan_log(logf, patterns, flags=0):
+    """
+    grep logf for each of patterns in a single pass; return a list
+    of matching lines per pattern, in file order
+    logs of PARALLEL_SCAN_SIZE or more are split into newline aligned
+    ranges which are scanned by a pool of worker processes
+    """
+    view = log_view(logf)
+    if view is None:
+        with open(logf, 'r') as fd:
+            data = fd.read()
+        return [[line for _, line in match_lines(compile_matcher(p, flags), data)]
+                for p in patterns]
+
+    workers = scan_workers()
+    if len(view) < constants.PARALLEL_SCAN_SIZE or workers < 2:
+        return _scan_range((logf, 0, len(view), patterns, flags))
+
+    args = [(logf, start, end, patterns, flags) for start, end in scan_ranges(view, workers)]
+    log_debug("scanning %s in %d ranges" % (logf, len(args)))
+    results = pool_map(_scan_range, args, min(workers, len(args)))
+    res = [[] for p in patterns]
+    for part in results:
+        for i, lines in enumerate(part):
+            res[i] += lines
+    return res
+
+def scan_ranges(view, parts):
+    """
+    split view into at most parts newline aligned (start, end) ranges
+    """
+    res = []
+    size = len(view)
+    start = 0
+    for i in range(1, parts + 1):
+        if start >= size:
+            break
+        end = size * i / parts
+        if end < size:
+            nl = view.find('\n', max(start, end - 1))
+            end = size if nl == -1 else nl + 1
+        res.append((start, end))
+        start = end
+    return res
+
+def scan_workers():
+    """
+    number of worker processes for scanning; SCAN_WORKERS or the
+    number of CPUs, at most LOW_IMPACT_WORKERS in low impact mode
+    """
+    if constants.SCAN_WORKERS > 0:
+        workers = constants.SCAN_WORKERS
+    else:
+        import multiprocessing
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    if constants.LOW_IMPACT:
+        workers = min(workers, constants.LOW_IMPACT_WORKERS)
+    return workers
+
+def send_workdir(peers=()):
+    """
+    write the tarball of this node's collected data, and of the
+    peers it relayed for, to stdout
+    """
+    names = [constants.WE] + [n for n in peers if os.path.isdir(os.path.join(constants.WORKDIR, "..", n))]
+    cmd = r"cd %s/.. && tar -h -cf - %s" % (constants.WORKDIR, ' '.join(names))
+    proc = spawn(cmd, shell=True, stdout=subprocess.PIPE)
+    copy_throttled(proc.stdout, sys.stdout)
+    proc.wait()
+    sys.stdout.flush()
+
 def sed_inplace(filename, pattern, repl):
     out_string = ""
 
@@ -1257,54 +3287,119 @@ def stdchannel_redirected(stdchannel, dest_filename):
         if dest_file is not None:
             dest_file.close()
 
-def start_slave_collector(node, arg_str):
-    if node == constants.WE:
-        cmd = r"hb_report __slave".format(os.getcwd())
-        for item in arg_str.split():
-            cmd += " {}".format(str(item))
-        _, out = crmutils.get_stdout(cmd)
-        cmd = r"(cd {} && tar xf -)".format(constants.WORKDIR)
-        crmutils.get_stdout(cmd, input_s=out)
+def show_jobs(jobs):
+    """
+    one status line of the nodes run_jobs is working on
+    """
+    counts = {}
+    for job in jobs:
+        counts[job.state] = counts.get(job.state, 0) + 1
+    status = ", ".join("%d %s" % (counts[state], state) for state in
+                       ("waiting", "running", "done", "failed", "timeout") if state in counts)
+    sys.stderr.write("\r%s: %s; %d KB received " % \
+                     (constants.WE, status, sum(job.nbytes for job in jobs) / 1024))
+    sys.stderr.flush()
+
+def since_arg(nodes):
+    """
+    the SINCE argument for the slave collecting nodes: their manifests
+    only, as those of a big cluster don't fit on one command line
+    """
+    if not constants.SINCE:
+        return ""
+    manifests = decode_manifests(constants.SINCE)
+    return " SINCE=%s" % encode_manifests(dict((n, manifests[n]) for n in nodes if n in manifests))
 
-    else:
-        cmd = r'ssh {} {} "{} hb_report __slave"'.\
-              format(constants.SSH_OPTS, node, \
-                     constants.SUDO, os.getcwd())
-        for item in arg_str.split():
-            cmd += " {}".format(str(item))
-        code, out, err = crmutils.get_stdout_stderr(cmd)
-        if code != 0:
-            log_warning(err)
-            for ip in get_peer_ip():
-                log_info("Trying connect by %s" % ip)
-                cmd = cmd.replace(node, ip, 1)
-                code, out, err = crmutils.get_stdout_stderr(cmd)
-                if code != 0:
-                    log_warning(err)
-                break
+def skip_line(fd):
+    """
+    read fd to the end of the current line; return the bytes read, or
+    None if the line isn't complete yet
+    """
+    skipped = 0
+    while True:
+        data = fd.readline(constants.RECORDER_SEGMENT)
+        skipped += len(data)
+        if not data:
+            return None
+        if data.endswith('\n'):
+            return skipped
+
+def skipped(name):
+    """
+    whether the budget planner decided to skip collector name
+    """
+    return name in constants.SKIPPED_STEPS
+
+@contextlib.contextmanager
+def span(name):
+    """
+    time the phase name, also when it is cut short by an exception
+    e.g.:
+    with span("get_log"):
+        get_log()
+    """
+    start = time.time()
+    usage = resource_usage()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.time() - start,
+                    [b - a for a, b in zip(usage, resource_usage())])
 
-        cmd = r"(cd {} && tar xf -)".format(constants.WORKDIR)
-        crmutils.get_stdout(cmd, input_s=out)
+def spawn(cmd, **kwargs):
+    """
+    subprocess.Popen(cmd, **kwargs), counted in SPAWNED; the processes
+    hb_report starts, including those of the probe threads, all go
+    through here
+    """
+    with _SPAWN_LOCK:
+        constants.SPAWNED += 1
+    return subprocess.Popen(cmd, **kwargs)
+
+def start_profile():
+    """
+    a running cProfile profiler with --profile, otherwise None
+    """
+    if not constants.PROFILE:
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def start_slave_collector(node, arg_str):
+    """
+    run the collector of node in the foreground, e.g. so that the
+    user can type the ssh password
+    """
+    job = collector_job(node, arg_str)
+    job.interactive = True
+    run_jobs([job])
+    if job.state == "failed":
+        log_warning(job.err)
 
 def sub_string(in_string,
                pattern=constants.SANITIZE,
                sub_pattern=' value=".*" ',
                repl=' value="******" '):
-    res_string = ""
+    res = []
     pattern_string = re.sub(" ", "|", pattern)
-    for line in in_string.split('\n')[:-1]:
-        if re.search('name="%s"'%pattern_string, line):
-            res_string += re.sub(sub_pattern, repl, line) + '\n'
-        else:
-            res_string += line + '\n'
-    return res_string
+    matcher = compile_matcher('name="%s"'%pattern_string)
+    sub_compiled = re.compile(sub_pattern)
+    pos = 0
+    for start, end in match_spans(matcher, in_string, partial=True):
+        res.append(in_string[pos:start])
+        res.append(sub_compiled.sub(repl, in_string[start:end]))
+        pos = end
+    res.append(in_string[pos:])
+    return ''.join(res)
 
 
 def sub_string_test(in_string, pattern=constants.SANITIZE):
     pattern_string = re.sub(" ", "|", pattern)
-    for line in in_string.split('\n'):
-        if re.search('name="%s"'%pattern_string, line):
-            return True
+    matcher = compile_matcher('name="%s"'%pattern_string)
+    for _ in match_spans(matcher, in_string, partial=True):
+        return True
     return False
 
 def sys_info():
@@ -1317,8 +3412,10 @@ def sys_info():
     out_string += "\n"
     out_string += "#####Cluster related packages:\n"
     out_string += pkg_versions(constants.PACKAGES)
-    if constants.SKIP_LVL == 0:
+    if constants.SKIP_LVL == 0 and not skipped("verify_packages"):
+        start = time.time()
         out_string += verify_packages(constants.PACKAGES)
+        record_cost("verify_packages", time.time() - start)
     out_string += "\n"
     out_string += "#####System info:\n"
     out_string += "Platform: %s\n" % os.uname()[0]
@@ -1348,13 +3445,20 @@ def sys_stats():
 def tail(n, indata):
     return indata.split('\n')[n-2:-1]
 
-def test_ssh_conn(addr):
-    cmd = r"ssh %s -T -o Batchmode=yes %s true" % (constants.SSH_OPTS, addr)
-    code, _ = get_command_info(cmd)
-    if code == 0:
-        return True
-    else:
-        return False
+def throttle(nbytes):
+    """
+    account nbytes of log reading or transfer and sleep as long as
+    needed to keep the average rate within BWLIMIT bytes per second
+    """
+    if not constants.BWLIMIT:
+        return
+    now = time.time()
+    if _IO_BUDGET[0] is None:
+        _IO_BUDGET[0] = now
+    _IO_BUDGET[1] += nbytes
+    ahead = _IO_BUDGET[1] / float(constants.BWLIMIT) - (now - _IO_BUDGET[0])
+    if ahead > 0:
+        time.sleep(ahead)
 
 def time_status():
     out_string = "Time: "
@@ -1365,10 +3469,51 @@ def time_status():
     time_f = os.path.join(constants.WORKDIR, constants.TIME_F)
     crmutils.str2file(out_string, time_f)
 
+def timed(func, *args):
+    """
+    run func as a span of its own, e.g. as the target of a process
+    """
+    with span(func.__name__):
+        func(*args)
+
+def timings_summary(timings):
+    """
+    the table printed with -v: seconds and resources per phase of
+    the master and each node, the spans of a phase added up
+    """
+    out_string = "%-16s %-32s %9s %9s %9s %9s %6s %9s %7s\n" % \
+                 ("where", "phase", "seconds", "+RSS(KB)", "read(MB)", "wrote(MB)", "procs",
+                  "child CPU", "avoided")
+    rows = [("master", timings["master"])] + sorted(timings["nodes"].items())
+    for where, spans in rows:
+        total = {}
+        order = []
+        for s in spans:
+            if s["name"] not in total:
+                total[s["name"]] = dict(s)
+                order.append(s["name"])
+                continue
+            t = total[s["name"]]
+            t["seconds"] += s["seconds"]
+            for k in _USAGE_KEYS:
+                if k in s and k in t:
+                    t[k] = max(t[k], s[k]) if k == "rss_kb" else t[k] + s[k]
+        for name in order:
+            t = total[name]
+            out_string += "%-16s %-32s %9.2f" % (where, name, t["seconds"])
+            if "rss_kb" in t:
+                out_string += " %9d %9.1f %9.1f %6d %9.2f %7d\n" % \
+                              (t["rss_kb"], t["read_bytes"] / 1048576.0,
+                               t["written_bytes"] / 1048576.0, t["processes"], t["children_cpu"],
+                               t["forks_avoided"])
+            else:
+                out_string += '\n'
+    return out_string
+
 def touch_dc():
     if constants.SKIP_LVL == 1:
         return
-    node = crmutils.get_dc()
+    node = cluster_probe().get("dc")
     if node and node == constants.WE:
         with open(os.path.join(constants.WORKDIR, "DC"), 'w') as f:
             pass
@@ -1383,16 +3528,132 @@ def touch_r(src, dst):
     stat_info = os.stat(src)
     os.utime(dst, (stat_info.st_atime, stat_info.st_mtime))
 
+def trim_log(logf, keep):
+    """
+    cut logf down to about keep bytes around its busiest part, on
+    line boundaries; return the time stamps of the kept lines
+    """
+    constants.GET_STAMP_FUNC = find_getstampproc(logf)
+    view = log_view(logf)
+    size = len(view)
+    peak = log_peak(logf)
+    start = max(0, min(peak - keep / 2, size - keep))
+    if start:
+        start = view.find('\n', start) + 1 or size
+    end = min(size, start + keep)
+    if end < size:
+        # no newline in the window: keep nothing rather than from 0
+        end = max(start, view.rfind('\n', start, end) + 1)
+    first = view_time(view, start, end)[0]
+    last = view_time(view, max(start, view.rfind('\n', start, max(start, end - 1)) + 1), end)[0]
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(logf))
+    with os.fdopen(fd, 'w') as outfd:
+        outfd.write(view[start:end])
+    os.rename(tmp, logf)
+    return first, last
+
+def trim_workdir(limit):
+    """
+    --max-size: give up the least important collected data until
+    this node's part of the report is no more than limit bytes;
+    logs are trimmed around their busiest part, PE inputs sampled,
+    the rest removed; what went is written to TRIMMED_F
+    """
+    def size_of(path):
+        # lstat: a link (to ha-log.txt, say) frees only itself
+        if os.path.isdir(path) and not os.path.islink(path):
+            return sum(os.lstat(os.path.join(root, f)).st_size
+                       for root, _, files in os.walk(path) for f in files)
+        return os.lstat(path).st_size
+
+    items = [(report_priority(name), size_of(os.path.join(constants.WORKDIR, name)), name)
+             for name in os.listdir(constants.WORKDIR)]
+    total = sum(size for _, size, _ in items)
+    if total <= limit:
+        return
+    out_string = ""
+    for prio, size, name in sorted(items, reverse=True):
+        if total <= limit or prio == 0:
+            break
+        path = os.path.join(constants.WORKDIR, name)
+        keep = max(0, size - (total - limit))
+        if os.path.islink(path) or not keep:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+            out_string += "%s: removed (%d bytes)\n" % (name, size)
+        elif os.path.isdir(path) and prio == 3:
+            kept, removed = sample_dir(path, keep)
+            out_string += "%s: kept %d of %d files\n" % (name, kept, kept + removed)
+        elif prio <= 2 and log_view(path) is not None:
+            first, last = trim_log(path, keep)
+            out_string += "%s: kept %d of %d bytes" % (name, os.path.getsize(path), size)
+            if first and last:
+                out_string += ", %s to %s" % (ts_to_dt(first).strftime("%x %X"),
+                                              ts_to_dt(last).strftime("%x %X"))
+            out_string += "\n"
+        else:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+            out_string += "%s: removed (%d bytes)\n" % (name, size)
+        total -= size - (size_of(path) if os.path.lexists(path) else 0)
+    crmutils.str2file(out_string, os.path.join(constants.WORKDIR, constants.TRIMMED_F))
+    log_debug("trimmed collected data to %d bytes" % total)
+
 def ts_to_dt(timestamp):
     """
     timestamp convert to datetime; consider local timezone
     """
+    from dateutil import tz
     dt = crmutils.timestamp_to_datetime(timestamp)
     dt += tz.tzlocal().utcoffset(dt)
     return dt
 
 def txt_diff(file1, file2):
-    return get_command_info("diff -bBu %s %s"%(file1, file2))[1]
+    """
+    unified diff of two files, ignoring changes in the amount of white
+    space and in blank lines, like diff -bBu; files together larger
+    than DIFF_MAX_SIZE are left to diff(1)
+    """
+    if os.path.getsize(file1) + os.path.getsize(file2) > constants.DIFF_MAX_SIZE:
+        return get_command_info("diff -bBu %s %s"%(file1, file2))[1]
+    import difflib
+    constants.FORKS_AVOIDED += 1
+    lines = []
+    for f in (file1, file2):
+        with open(f, 'r') as fd:
+            text = fd.read().split('\n')
+        if not text[-1]:
+            text.pop()
+        lines.append(text)
+    keys = [[re.sub(r"\s+", " ", l.rstrip()) for l in ls] for ls in lines]
+
+    def span_str(start, length):
+        if length == 1:
+            return "%d" % (start + 1)
+        return "%d,%d" % (start + 1 if length else start, length)
+
+    out = []
+    matcher = difflib.SequenceMatcher(None, keys[0], keys[1], autojunk=False)
+    for group in matcher.get_grouped_opcodes(3):
+        # a hunk changing only blank lines is left out, as diff -B does
+        if not any(any(keys[0][i1:i2]) or any(keys[1][j1:j2])
+                   for tag, i1, i2, j1, j2 in group if tag != "equal"):
+            continue
+        if not out:
+            out += ["--- %s" % file1, "+++ %s" % file2]
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        out.append("@@ -%s +%s @@" % (span_str(i1, i2 - i1), span_str(j1, j2 - j1)))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                out += [' ' + l for l in lines[0][i1:i2]]
+                continue
+            out += ['-' + l for l in lines[0][i1:i2]]
+            out += ['+' + l for l in lines[1][j1:j2]]
+    return ''.join(l + '\n' for l in out)
 
 def verify_deb(packages):
     pass
@@ -1420,15 +3681,241 @@ def verify_rpm(packages):
     res = ""
     for pack in packages.split():
         cmd = r"rpm --verify %s|grep -v 'not installed'" % pack
-        code, out = crmutils.get_stdout(cmd)
+        code, out, _ = get_stdout_stderr(cmd)
         if code != 0 and out:
             res = "For package %s:\n" % pack
             res += out + "\n"
     return res
 
+def unpack_report(report, dest_dir):
+    """
+    return the directory of report, extracting it into dest_dir
+    first if it is a tarball
+    """
+    if os.path.isdir(report):
+        return report
+    _mkdir(dest_dir)
+    code, _, err = get_stdout_stderr("tar -xf %s -C %s" % (report, dest_dir))
+    if code != 0:
+        log_fatal("could not extract %s: %s" % (report, err))
+    return os.path.join(dest_dir, os.listdir(dest_dir)[0])
+
+def view_chunks(view, start=0, end=None, size=None):
+    """
+    iterate view[start:end] in strings of about size bytes which end
+    on a line boundary, so that only one chunk is copied at a time
+    """
+    if end is None:
+        end = len(view)
+    if not size:
+        size = constants.SCAN_CHUNK_SIZE
+    pos = start
+    while pos < end:
+        stop = min(pos + size, end)
+        if stop < end:
+            nl = view.rfind('\n', pos, stop)
+            if nl == -1:
+                nl = view.find('\n', stop, end)
+            stop = end if nl == -1 else nl + 1
+        yield view[pos:stop]
+        pos = stop
+
+def view_last_lines(view, n):
+    """
+    return up to n last lines of view, the last line first
+    """
+    res = []
+    end = len(view)
+    if end and view[end-1] == '\n':
+        end -= 1
+    while len(res) < n:
+        start = view.rfind('\n', 0, end) + 1
+        res.append(view[start:end])
+        if start == 0:
+            break
+        end = start - 1
+    return res
+
+def view_lines(view, start=0, end=None):
+    """
+    iterate the lines of view[start:end], without the newlines
+    """
+    if end is None:
+        end = len(view)
+    pos = start
+    while pos < end:
+        nl = view.find('\n', pos, end)
+        if nl == -1:
+            yield view[pos:end]
+            break
+        yield view[pos:nl]
+        pos = nl + 1
+
+def view_slice(view, start, end):
+    """
+    zero-copy slice of view, suitable for file.write
+    """
+    return buffer(view, start, end - start)
+
+def view_time(view, pos, end, trycnt=10):
+    """
+    timestamp of the line at offset pos; if it has none, try up to
+    trycnt following lines before end
+    return (ts, line_start, next_line_start); ts is None on failure
+    """
+    while trycnt > 0 and pos < end:
+        nl = view.find('\n', pos, end)
+        next_pos = end if nl == -1 else nl + 1
+        ts = get_ts(view[pos:next_pos].rstrip('\n'))
+        if ts:
+            return (ts, pos, next_pos)
+        log_debug("cannot extract time at offset %d; will try the next line" % pos)
+        trycnt -= 1
+        pos = next_pos
+    return (None, pos, pos)
+
+def write_impact(start):
+    """
+    record how long this node's collection took and how much I/O it
+    did (including the processes it started) in IMPACT_F
+    """
+    out_string = "collection time: %.1f seconds\n" % (time.time() - start)
+    if os.path.isfile("/proc/self/io"):
+        io = {}
+        with open("/proc/self/io", 'r') as f:
+            for line in f:
+                k, v = line.split(':')
+                io[k] = int(v)
+        out_string += "bytes read: %d (%d from storage)\n" % (io["rchar"], io["read_bytes"])
+        out_string += "bytes written: %d (%d to storage)\n" % (io["wchar"], io["write_bytes"])
+    if constants.LOW_IMPACT:
+        out_string += "low impact mode: nice %d, %d worker(s), bwlimit %s\n" % \
+                      (os.nice(0), scan_workers(), constants.BWLIMIT or "none")
+    crmutils.str2file(out_string, os.path.join(constants.WORKDIR, constants.IMPACT_F))
+
+def write_timings(workdir):
+    """
+    merge our spans and those the nodes sent into TIMINGS_F, a
+    timeline per node with the start of each span in seconds since
+    the start of this run and, where known, what it used: peak RSS
+    growth, bytes read and written, processes started, CPU seconds
+    of the children and forks avoided; return the merged timings
+    """
+    import json
+
+    def read_spans(spans_f):
+        spans = []
+        if not os.path.isfile(spans_f):
+            return spans
+        for line in open(spans_f):
+            fields = line.split()
+            try:
+                s = {"name": fields[0],
+                     "start": round(float(fields[1]) - constants.START_TIME, 3),
+                     "seconds": float(fields[2])}
+                if len(fields) == 3 + len(_USAGE_KEYS):
+                    s.update(zip(_USAGE_KEYS, [int(x) for x in fields[3:7]] +
+                                 [float(fields[7]), int(fields[8])]))
+            except (IndexError, ValueError):
+                continue
+            spans.append(s)
+        os.unlink(spans_f)
+        return sorted(spans, key=lambda s: s["start"])
+
+    timings = {"start_time": constants.START_TIME,
+               "master": read_spans(os.path.join(workdir, constants.SPANS_F)),
+               "nodes": {}}
+    for spans_f in glob.glob(os.path.join(workdir, "*", constants.SPANS_F)):
+        timings["nodes"][os.path.basename(os.path.dirname(spans_f))] = read_spans(spans_f)
+    with open(os.path.join(workdir, constants.TIMINGS_F), 'w') as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+    return timings
+
+def write_manifest():
+    """
+    write MANIFEST_F, what this node's report holds: where the logs
+    ended, the latest PE inputs and digests of the other files; it is
+    the base of a later --since-report
+    for a delta report, files with the same digest as in the base
+    report are removed and listed as "same"; the logs are listed as
+    "append", as they continue those of the base
+    """
+    base = constants.DELTA_BASE
+    out_string = "node %s\n" % constants.WE
+    out_string += "report %s\n" % constants.DEST
+    # the time span of the report including its base reports
+    from_time = constants.FROM_TIME
+    if base:
+        from_time = min(from_time, base["from_time"])
+    out_string += "from_time %d\n" % from_time
+    out_string += "to_time %d\n" % (constants.TO_TIME or constants.START_TIME)
+    if base:
+        out_string += "base %s\n" % base["report"]
+    cursor_f = os.path.join(constants.WORKDIR, constants.JOURNAL_CURSOR_F)
+    if os.path.isfile(cursor_f):
+        out_string += "journal %s\n" % open(cursor_f).read().split(None, 1)[1].strip()
+    out_string += ''.join(line + '\n' for line in _MANIFEST)
+
+    pe_last = dict(base["pe"]) if base else {}
+    pe_dir = os.path.basename(constants.PE_STATE_DIR or "pengine")
+    if os.path.isdir(os.path.join(constants.WORKDIR, pe_dir)):
+        for f in os.listdir(os.path.join(constants.WORKDIR, pe_dir)):
+            seq = pe_seq(f)
+            if seq and seq[1] > pe_last.get(seq[0], -1):
+                pe_last[seq[0]] = seq[1]
+    for series in sorted(pe_last):
+        out_string += "pe %s %d\n" % (series, pe_last[series])
+
+    logs = [line.split()[1] for line in _MANIFEST] + [constants.JOURNAL_F]
+    skip = logs + [constants.MANIFEST_F, constants.JOURNAL_CURSOR_F, constants.SPANS_F]
+    for root, dirs, files in os.walk(constants.WORKDIR):
+        if root == constants.WORKDIR and pe_dir in dirs:
+            dirs.remove(pe_dir)
+        for f in sorted(files):
+            path = os.path.join(root, f)
+            rel = os.path.relpath(path, constants.WORKDIR)
+            if rel in skip or os.path.islink(path):
+                continue
+            digest = hashlib.md5()
+            with open(path, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1024*1024), ''):
+                    digest.update(chunk)
+            if base and base["files"].get(rel) == digest.hexdigest():
+                os.unlink(path)
+                out_string += "same %s %s\n" % (rel, digest.hexdigest())
+            else:
+                out_string += "file %s %s\n" % (rel, digest.hexdigest())
+    if base:
+        for name in logs:
+            if os.path.isfile(os.path.join(constants.WORKDIR, name)):
+                out_string += "append %s\n" % name
+    crmutils.str2file(out_string, os.path.join(constants.WORKDIR, constants.MANIFEST_F))
+
+def write_view(outfd, view, start, end):
+    """
+    write view[start:end] to outfd without copying, within BWLIMIT
+    """
+    pos = start
+    while pos < end:
+        size = min(end - pos, 1024*1024) if constants.BWLIMIT else end - pos
+        outfd.write(view_slice(view, pos, pos + size))
+        throttle(size)
+        pos += size
+
 def which(prog):
-    code, _ = get_command_info("which %s" % prog)
-    if code == 0:
-        return True
-    else:
-        return False
+    """
+    the path of prog in PATH, or None; looked up once per process
+    """
+    key = (prog, os.environ.get("PATH", ""))
+    if key not in _WHICH_CACHE:
+        path = None
+        if os.sep in prog:
+            path = prog if is_exec(prog) else None
+        else:
+            for d in key[1].split(os.pathsep):
+                if is_exec(os.path.join(d, prog)):
+                    path = os.path.join(d, prog)
+                    break
+        _WHICH_CACHE[key] = path
+        constants.FORKS_AVOIDED += 1
+    return _WHICH_CACHE[key]